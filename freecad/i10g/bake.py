@@ -0,0 +1,168 @@
+import json
+import hashlib
+import numpy
+from freecad.i10g import engine
+
+
+VERSION = 3
+
+# Row layout: pos(3), quat(4), rgb(3), transparency(1), flags(1)
+COLUMNS = 12
+DRIVEN = 1
+MATERIAL = 2
+LINK = 4
+PRESENT = 8
+
+
+class Bake:
+
+    def __init__(self, path=None):
+        self.path = path
+        self.names = []
+        self.segments = []
+        self.stale = set()
+        # Rows are written back to the document, so they keep float64
+        self.data = numpy.zeros((0, 0, COLUMNS), dtype=numpy.float64)
+        if path:
+            self.load()
+
+    def __len__(self):
+        return len(self.data)
+
+    def load(self):
+        try:
+            with open(f'{self.path}.json') as fp:
+                meta = json.load(fp)
+            if meta.get('version') != VERSION:
+                return
+            data = numpy.load(f'{self.path}.npy', mmap_mode='r+')
+        except (OSError, ValueError):
+            return
+        if data.shape[1:] != (len(meta['names']), COLUMNS):
+            return
+        self.names = meta['names']
+        self.segments = meta['segments']
+        self.data = data
+
+    def save(self):
+        if not isinstance(self.data, numpy.memmap):
+            return
+        self.data.flush()
+        self.saveMeta(self.path)
+
+    def saveMeta(self, path):
+        with open(f'{path}.json', 'w') as fp:
+            json.dump({
+                'version': VERSION,
+                'names': self.names,
+                'segments': self.segments,
+            }, fp)
+
+    def copy(self, path):
+        # Writes the bake to path, loaded by Bake(path)
+        numpy.save(f'{path}.npy', numpy.asarray(self.data))
+        self.saveMeta(path)
+
+    def invalidate(self, segments=None):
+        if segments is None:
+            segments = range(len(self.segments))
+        self.stale.update(segments)
+
+    def allocate(self, frames, names):
+        shape = (frames, len(names), COLUMNS)
+        self.data = None
+        if self.path:
+            try:
+                self.data = numpy.lib.format.open_memmap(
+                    f'{self.path}.npy', 'w+', numpy.float64, shape)
+            except OSError:
+                # e.g. a read-only folder, the bake is kept in memory
+                pass
+        if self.data is None:
+            self.data = numpy.zeros(shape, dtype=numpy.float64)
+        self.names = names
+        self.segments = []
+
+    def update(self, names, plan):
+        # plan: [(signature, deltas, segmentFactory)] for every step pair
+        layout = [len(deltas) for _, deltas, _ in plan]
+        if names != self.names or layout != [s[1] for s in self.segments]:
+            self.allocate(sum(layout), names)
+        start = 0
+        segments = []
+        changed = False
+        for i, (signature, deltas, factory) in enumerate(plan):
+            old = self.segments[i] if i < len(self.segments) else None
+            if i in self.stale or not old or old[2] != signature:
+                # Objects that moved since the last frame are settled on
+                # the first one, every object on the very first frame
+                entry = numpy.zeros(len(names), dtype=bool)
+                j = i - 1
+                while j >= 0:
+                    prev = plan[j][2]()
+                    entry[self.columns(prev.names)] |= prev.changed
+                    if len(plan[j][1]):
+                        break
+                    j -= 1
+                if j < 0:
+                    entry[:] = True
+                self.write(start, factory(), deltas, entry)
+                changed = True
+            segments.append([start, len(deltas), signature])
+            start += len(deltas)
+        self.segments = segments
+        self.stale.clear()
+        if changed:
+            self.save()
+        return changed
+
+    def columns(self, names):
+        index = {name: i for i, name in enumerate(self.names)}
+        return numpy.array([index[n] for n in names], dtype=int)
+
+    def write(self, start, segment, deltas, entry, batch=64):
+        cols = self.columns(segment.names)
+        flags = PRESENT + MATERIAL * segment.material + LINK * segment.link
+        flags = numpy.where(segment.changed, flags + DRIVEN, flags)
+        first = numpy.where(entry[cols], flags | DRIVEN, flags)
+        for i in range(0, len(deltas), batch):
+            frame = segment.frame(deltas[i:i + batch])
+            rows = numpy.zeros((len(frame), len(self.names), COLUMNS),
+                               dtype=numpy.float64)
+            rows[:, cols, 0:3] = frame.pos
+            rows[:, cols, 3:7] = frame.quat
+            rows[:, cols, 7:10] = frame.rgb
+            rows[:, cols, 10] = frame.transparency
+            rows[:, cols, 11] = flags
+            if i == 0:
+                rows[0, cols, 11] = first
+            self.data[start + i:start + i + len(frame)] = rows
+
+    def frame(self, i, full=False, since=None):
+        # A full frame drives every object, e.g. when seeking. Frames after
+        # since were skipped, what they drove is driven by this one
+        row = numpy.asarray(self.data[i])
+        flags = row[:, 11].astype(numpy.uint8)
+        driven = flags & (PRESENT if full else DRIVEN) > 0
+        if since is not None and since + 1 < i:
+            skipped = self.data[max(since + 1, 0):i, :, 11]
+            driven |= numpy.any(skipped.astype(numpy.uint8) & DRIVEN, 0)
+        return engine.Frame(
+            self.names,
+            flags & LINK > 0,
+            flags & MATERIAL > 0,
+            row[:, 0:3],
+            row[:, 3:7],
+            row[:, 7:10],
+            row[:, 10],
+            driven=driven,
+        )
+
+    def digest(self, i, salt=b''):
+        # Hashes what ends up on screen, regardless of what is driven
+        row = numpy.array(self.data[i])
+        row[:, 11] = row[:, 11].astype(numpy.uint8) & (0xff ^ DRIVEN)
+        h = hashlib.sha1(salt)
+        h.update('\0'.join(self.names).encode())
+        h.update(row.tobytes())
+        return h.hexdigest()
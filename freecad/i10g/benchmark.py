@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy
+from freecad.i10g import __version__
+from freecad.i10g import engine
+from freecad.i10g import bake
+from freecad.i10g.render import emit
+
+
+SIZES = [10, 100, 1000, 10000]
+
+
+def measure(fn, repeat=3, count=1):
+    # Seconds per call, fn may run count calls at once
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) / count)
+    return {'min': min(times), 'mean': sum(times) / len(times)}
+
+
+def syntheticStates(objects, steps, seed=0):
+    rng = numpy.random.default_rng(seed)
+    names = [f'Link{i:05d}' for i in range(objects)]
+    states = []
+    for _ in range(steps):
+        quat = rng.normal(size=(objects, 4))
+        quat /= numpy.linalg.norm(quat, axis=1)[:, None]
+        placement = numpy.hstack([rng.uniform(-100, 100, (objects, 3)), quat])
+        flags = numpy.full(objects, engine.VISIBLE | engine.LINK)
+        flags[::2] |= engine.MATERIAL
+        rgba = rng.uniform(0, 1, (objects, 4))
+        states.append(engine.buildState(names, placement, flags, rgba))
+    return states
+
+
+def benchEngine(objects, steps, fps, repeat):
+    # Pure NumPy paths, no FreeCAD needed
+    states = syntheticStates(objects, max(steps, 2))
+    encoded = engine.encodeState(states[0])
+    # Steps are pooled by default, so every state shares one pool
+    pool = engine.StatePool()
+    snapshot = -1
+    for state in states:
+        snapshot = pool.snapshot(state, snapshot)
+    pooled = engine.encodePooled(snapshot)
+    segment = engine.Segment(states[0], states[1])
+    deltas = numpy.linspace(0, 1, 64)
+    timeline = engine.Timeline([1] * (len(states) - 1), fps)
+
+    def bakeAll():
+        plan = [(str(i), timeline.segment(i),
+                 lambda i=i: engine.Segment(states[i], states[i + 1]))
+                for i in range(len(states) - 1)]
+        bake.Bake().update(states[0].names, plan)
+
+    return {
+        'encodeState': measure(lambda: engine.encodeState(states[0]),
+                               repeat),
+        'decodeState': measure(lambda: engine.decodeState(encoded), repeat),
+        'intern': measure(lambda: pool.intern(states[0]), repeat),
+        'snapshot': measure(lambda: pool.snapshot(states[-1], snapshot),
+                            repeat),
+        'take': measure(lambda: pool.take(states[0].objects, states[0].ids),
+                        repeat),
+        'decodePooled': measure(
+            lambda: engine.decodeState(pooled, pool=pool), repeat),
+        'diffState': measure(lambda: engine.diffState(states[0], states[1]),
+                             repeat),
+        'segment': measure(lambda: engine.Segment(states[0], states[1]),
+                           repeat),
+        'frame': measure(lambda: segment.frame(0.5), repeat),
+        'batchFrame': measure(lambda: segment.frame(deltas), repeat,
+                              len(deltas)),
+        'bakeFrame': measure(bakeAll, repeat, len(timeline)),
+    }
+
+
+def benchFreeCAD(objects, steps, fps, repeat, ffmpeg=None):
+    import FreeCAD as App
+    from freecad.i10g import i10g
+
+    results = {}
+    doc = App.newDocument('i10gBenchmark')
+    App.setActiveDocument(doc.Name)
+    tmpdir = tempfile.mkdtemp(prefix='i10g')
+    try:
+        rng = numpy.random.default_rng(0)
+        box = doc.addObject('Part::Box', 'Box')
+        links = []
+        for _ in range(objects):
+            link = doc.addObject('App::Link', 'Link')
+            link.LinkedObject = box
+            links.append(link)
+        doc.recompute()
+
+        def move():
+            for link, pos in zip(links, rng.uniform(-100, 100,
+                                                    (objects, 3)).tolist()):
+                link.Placement = App.Placement(
+                    App.Vector(*pos), App.Rotation(*rng.uniform(0, 360, 3)))
+
+        results['createObjState'] = measure(
+            lambda: [i10g.createObjState(o) for o in links], repeat, objects)
+        results['getState'] = measure(i10g.getState, repeat)
+        start = time.perf_counter()
+        animation = i10g.Animation()
+        for _ in range(steps - 1):
+            move()
+            animation.addStep()
+        results['create'] = {'min': time.perf_counter() - start}
+        prev, step = animation.getSteps()[-2:]
+
+        def capture():
+            # Without a baseline every object is read again
+            animation.setBaseline(None)
+            step.updateState(True)
+
+        results['updateState'] = measure(capture, repeat)
+
+        def hydrate():
+            step._arrays = None
+            step.hydrate()
+
+        results['hydrate'] = measure(hydrate, repeat)
+        results['anim'] = measure(lambda: step.anim(prev, 0.5), repeat)
+
+        def apply():
+            # Otherwise the step is applied over itself and writes nothing
+            animation.setBaseline(None)
+            step.apply()
+
+        results['apply'] = measure(apply, repeat)
+
+        path = os.path.join(tmpdir, 'benchmark.FCStd')
+        digests = [s.digest() for s in animation.getSteps()]
+        doc.saveAs(path)
+        App.closeDocument(doc.Name)
+        start = time.perf_counter()
+        doc = App.openDocument(path)
+        animation = i10g.Animation(doc.getObject('Animation'))
+        results['load'] = {'min': time.perf_counter() - start}
+        # Without a DocumentObserver, so the state pool must come along
+        if [s.digest() for s in animation.getSteps()] != digests:
+            raise RuntimeError('steps changed when saved and loaded again')
+        results['bake'] = measure(lambda: animation.bake(fps), 1)
+        if ffmpeg:
+            stats = animation.render(
+                progress=lambda *args: None,
+                output=os.path.join(tmpdir, 'benchmark.mp4'),
+                resolution='320x240',
+                fps=fps,
+                ffmpeg=ffmpeg,
+                capture='Offscreen',
+                workers=1,
+                cache=0,
+            )
+            results['render'] = {'fps': stats['fps'],
+                                 'frames': stats['frames']}
+    finally:
+        App.closeDocument(doc.Name)
+        shutil.rmtree(tmpdir)
+    return results
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m freecad.i10g.benchmark',
+        description='Time i10g on synthetic assemblies of App::Link objects '
+                    'and print the results as JSON.')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='object counts (default: %(default)s)')
+    parser.add_argument('--steps', type=int, default=4,
+                        help='steps per animation (default: %(default)s)')
+    parser.add_argument('--fps', type=int, default=24)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='best of N runs (default: %(default)s)')
+    parser.add_argument('--engine', action='store_true',
+                        help='only time the pure interpolation paths, '
+                             'without FreeCAD')
+    parser.add_argument('--ffmpeg', help='also time an offscreen render')
+    parser.add_argument('-o', '--output', help='write the results to a file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    if not args.engine:
+        import FreeCADGui as Gui
+        if not Gui.getMainWindow():
+            Gui.setupWithoutGUI()
+    runs = []
+    for objects in (int(n) for n in args.sizes.split(',')):
+        emit('start', objects=objects, steps=args.steps)
+        run = {
+            'objects': objects,
+            'steps': args.steps,
+            'engine': benchEngine(objects, args.steps, args.fps, args.repeat),
+        }
+        if not args.engine:
+            run['freecad'] = benchFreeCAD(objects, args.steps, args.fps,
+                                          args.repeat, args.ffmpeg)
+        runs.append(run)
+    report = {
+        'version': __version__,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'machine': platform.machine(),
+        'runs': runs,
+    }
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+    else:
+        emit('report', **report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
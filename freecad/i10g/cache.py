@@ -0,0 +1,79 @@
+import os
+import zlib
+import collections
+
+
+class FrameCache:
+
+    def __init__(self, path, size=1024):
+        # size is in MB, frames are evicted least recently used first
+        self.path = path
+        self.limit = size * 1024 * 1024
+        self.index = collections.OrderedDict()
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        entries = []
+        try:
+            for name in os.listdir(self.path):
+                if not name.endswith('.z'):
+                    continue
+                st = os.stat(os.path.join(self.path, name))
+                entries.append((st.st_mtime, name[:-2], st.st_size))
+        except OSError:
+            os.makedirs(self.path, exist_ok=True)
+        for _, key, size in sorted(entries):
+            self.index[key] = size
+            self.total += size
+
+    def file(self, key):
+        return os.path.join(self.path, f'{key}.z')
+
+    def get(self, key, size=None):
+        if key not in self.index:
+            self.misses += 1
+            return None
+        try:
+            with open(self.file(key), 'rb') as fp:
+                data = zlib.decompress(fp.read())
+            os.utime(self.file(key))
+        except (OSError, zlib.error):
+            self.drop(key)
+            self.misses += 1
+            return None
+        if size is not None and len(data) != size:
+            self.misses += 1
+            return None
+        self.index.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        data = zlib.compress(data, 1)
+        tmp = f'{self.file(key)}.{os.getpid()}'
+        with open(tmp, 'wb') as fp:
+            fp.write(data)
+        # Workers may share the cache, entries are replaced atomically
+        os.replace(tmp, self.file(key))
+        self.total += len(data) - self.index.pop(key, 0)
+        self.index[key] = len(data)
+        while self.total > self.limit and len(self.index) > 1:
+            self.drop(next(iter(self.index)))
+
+    def drop(self, key):
+        self.total -= self.index.pop(key, 0)
+        try:
+            os.remove(self.file(key))
+        except OSError:
+            pass
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'frames': len(self.index),
+            'size': self.total,
+        }
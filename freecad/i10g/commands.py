@@ -28,7 +28,7 @@ class FirstStepCmd():
     def Activated(self):
         a = STATE['animation']
         Gui.Selection.clearSelection()
-        Gui.Selection.addSelection(a.obj.Group[0])
+        Gui.Selection.addSelection(a.getGroup()[0])
 
     def IsActive(self):
         return STATE['animation'] and STATE['step'] != 0 and not STATE['play']
@@ -45,7 +45,7 @@ class PrevStepCmd():
     def Activated(self):
         a = STATE['animation']
         Gui.Selection.clearSelection()
-        Gui.Selection.addSelection(a.obj.Group[STATE['step'] - 1])
+        Gui.Selection.addSelection(a.getGroup()[STATE['step'] - 1])
 
     def IsActive(self):
         return STATE['animation'] and STATE['step'] != 0 and not STATE['play']
@@ -57,6 +57,8 @@ class PlayCtrlCmd():
             'Pixmap': f'{ICONPATH}/play.svg',
             'MenuText': 'Play animation',
             'ToolTip': 'Play animation',
+            # Frames are applied outside of the undo history
+            'CmdType': 'NoTransaction',
         }
 
     def Activated(self):
@@ -75,7 +77,7 @@ class PauseCtrlCmd():
         }
 
     def Activated(self):
-        STATE['play'] = False
+        STATE['animation'].pause()
 
     def IsActive(self):
         return STATE['animation'] and STATE['play'] and not STATE['render']
@@ -92,7 +94,7 @@ class NextStepCmd():
     def Activated(self):
         a = STATE['animation']
         Gui.Selection.clearSelection()
-        Gui.Selection.addSelection(a.obj.Group[STATE['step'] + 1])
+        Gui.Selection.addSelection(a.getGroup()[STATE['step'] + 1])
 
     def IsActive(self):
         return STATE['animation'] and STATE['step'] < STATE['#step'] and \
@@ -110,7 +112,7 @@ class LastStepCmd():
     def Activated(self):
         a = STATE['animation']
         Gui.Selection.clearSelection()
-        Gui.Selection.addSelection(a.obj.Group[STATE['#step'] - 1])
+        Gui.Selection.addSelection(a.getGroup()[STATE['#step'] - 1])
 
     def IsActive(self):
         return STATE['animation'] and STATE['step'] < STATE['#step'] and \
@@ -144,7 +146,7 @@ class CopyStepCmd():
     def Activated(self):
         a = STATE['animation']
         selection = Gui.Selection.getCompleteSelection()
-        if selection[0] == STATE['animation'].obj.Group[-1]:
+        if selection[0] == a.getGroup()[-1]:
             a.addStep()
         else:
             a.addStep(before=STATE['step'] + 1)
@@ -165,7 +167,7 @@ class UpdateStepCmd():
 
     def Activated(self):
         a = STATE['animation']
-        obj = a.obj.Group[STATE['step']]
+        obj = a.getGroup()[STATE['step']]
         a.steps[obj.Name].updateState(True)
 
     def IsActive(self):
@@ -178,6 +180,8 @@ class RenderCmd():
             'Pixmap': f'{ICONPATH}/video.svg',
             'MenuText': 'Render Animation',
             'ToolTip': 'Export video file',
+            # Frames are applied outside of the undo history
+            'CmdType': 'NoTransaction',
         }
 
     def Activated(self):
@@ -194,25 +198,13 @@ class RenderGIFCmd():
             'Pixmap': f'{ICONPATH}/gif.svg',
             'MenuText': 'Render Animation',
             'ToolTip': 'Export gif file',
+            # Frames are applied outside of the undo history
+            'CmdType': 'NoTransaction',
         }
 
     def Activated(self):
-        start = time.time()
-        STATE['animation'].video()
-        ffmpeg = STATE['animation'].obj.getPropertyByName('FFmpeg')
         video = STATE['animation'].obj.getPropertyByName('OutputFilename')
-        res = STATE['animation'].obj.getPropertyByName('Resolution')
-        params = f'{ffmpeg} -y -i {video} -vf palettegen /tmp/palette.png'
-        p = subprocess.Popen(params.split(), stdin=None)
-        p.wait()
-        outfile = os.path.splitext(video)[0]
-        params = f'{ffmpeg} -y -i {video} -i /tmp/palette.png '
-        params += f'-filter_complex paletteuse {outfile}.gif'
-        p = subprocess.Popen(params.split(), stdin=None)
-        p.wait()
-        dt = time.time() - start
-        dt = '{:0>2.0f}:{:0>2.0f}'.format(dt//60, dt%60)
-        print(f'Done in {dt}')
+        STATE['animation'].video(output=f'{os.path.splitext(video)[0]}.gif')
 
     def IsActive(self):
         return STATE['animation'] and (not STATE['play']) and \
@@ -0,0 +1,639 @@
+import numpy
+import base64
+import hashlib
+
+
+DEFAULT_COLOR = (0.80, 0.80, 0.80)
+
+# DocState formats: legacy states are plain dicts of dicts, compact
+# states hold the values of their objects, pooled states only hold the
+# id of a snapshot in the animation's StatePool
+COMPACT = 2
+POOLED = 3
+VERSION = POOLED
+# Snapshots are diffs against the previous step, resolving one applies
+# at most this many
+KEYFRAME_INTERVAL = 16
+VISIBLE = 1
+LINK = 2
+MATERIAL = 4
+
+
+def matrixToPose(m):
+    m = numpy.asarray(m, dtype=float).reshape(-1, 4, 4)
+    pos = m[:, :3, 3].copy()
+    r = m[:, :3, :3]
+    r00, r01, r02 = r[:, 0, 0], r[:, 0, 1], r[:, 0, 2]
+    r10, r11, r12 = r[:, 1, 0], r[:, 1, 1], r[:, 1, 2]
+    r20, r21, r22 = r[:, 2, 0], r[:, 2, 1], r[:, 2, 2]
+    # Shepperd's method, picking the largest pivot for each row
+    pivot = numpy.argmax(numpy.stack([r00 + r11 + r22, r00, r11, r22]), 0)
+    quat = numpy.empty((len(m), 4))
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        s = numpy.sqrt(numpy.maximum(1 + r00 + r11 + r22, 1e-12)) * 2
+        w = numpy.stack([(r21 - r12)/s, (r02 - r20)/s, (r10 - r01)/s, s/4], 1)
+        s = numpy.sqrt(numpy.maximum(1 + r00 - r11 - r22, 1e-12)) * 2
+        x = numpy.stack([s/4, (r01 + r10)/s, (r02 + r20)/s, (r21 - r12)/s], 1)
+        s = numpy.sqrt(numpy.maximum(1 + r11 - r00 - r22, 1e-12)) * 2
+        y = numpy.stack([(r01 + r10)/s, s/4, (r12 + r21)/s, (r02 - r20)/s], 1)
+        s = numpy.sqrt(numpy.maximum(1 + r22 - r00 - r11, 1e-12)) * 2
+        z = numpy.stack([(r02 + r20)/s, (r12 + r21)/s, s/4, (r10 - r01)/s], 1)
+    for i, q in enumerate((w, x, y, z)):
+        quat[pivot == i] = q[pivot == i]
+    quat /= numpy.linalg.norm(quat, axis=1)[:, None]
+    return pos, quat
+
+
+class StepArrays:
+
+    def __init__(self, table, objects, pos, quat, visible, link, material,
+                 rgb, transparency, ids=None):
+        # Rows are objects of the name table, shared between steps
+        self.table = table
+        self.objects = objects
+        self.pos = pos
+        self.quat = quat
+        self.visible = visible
+        self.link = link
+        self.material = material
+        self.rgb = rgb
+        self.transparency = transparency
+        # Pool ids, equal ids mean equal object states
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.objects)
+
+    @property
+    def names(self):
+        return self.table.get(self.objects)
+
+    def take(self, idx):
+        return StepArrays(self.table, self.objects[idx], self.pos[idx],
+                          self.quat[idx], self.visible[idx], self.link[idx],
+                          self.material[idx], self.rgb[idx],
+                          self.transparency[idx],
+                          None if self.ids is None else self.ids[idx])
+
+    def nbytes(self):
+        arrays = (self.objects, self.pos, self.quat, self.visible, self.link,
+                  self.material, self.rgb, self.transparency)
+        size = sum(array.nbytes for array in arrays)
+        if self.ids is not None:
+            size += self.ids.nbytes
+        return size
+
+    def digest(self):
+        if not hasattr(self, '_digest'):
+            h = hashlib.sha1('\0'.join(self.names).encode())
+            for array in (self.pos, self.quat, self.visible, self.link,
+                          self.material, self.rgb, self.transparency):
+                h.update(numpy.ascontiguousarray(array).tobytes())
+            self._digest = h.hexdigest()
+        return self._digest
+
+    def effectiveMaterial(self):
+        # Hidden objects fade through a fully transparent default material
+        has = self.material | ~self.visible
+        rgb = numpy.where(self.material[:, None], self.rgb, DEFAULT_COLOR)
+        t = numpy.where(self.material, self.transparency,
+                        numpy.where(self.visible, 0.0, 1.0))
+        return has, rgb, t
+
+
+def packState(state, table=None):
+    values = list(state.values())
+    n = len(values)
+    matrix = numpy.array([v['pos'] for v in values], dtype=float)
+    pos, quat = matrixToPose(matrix.reshape(n, 16))
+    table = NameTable() if table is None else table
+    return StepArrays(
+        table,
+        table.lookup([v['name'] for v in values]),
+        pos,
+        quat,
+        numpy.array([bool(v['visible']) for v in values], dtype=bool),
+        numpy.array([v['material'] is not None for v in values], dtype=bool),
+        numpy.array([bool(v['material']) for v in values], dtype=bool),
+        numpy.array([(v['color'] or DEFAULT_COLOR)[:3] for v in values],
+                    dtype=float).reshape(n, 3),
+        numpy.array([v['transparency'] or 0 for v in values], dtype=float),
+    )
+
+
+def buildState(names, placement, flags, rgba, table=None):
+    table = NameTable() if table is None else table
+    return unpackRows(table, table.lookup(names), placement, flags, rgba)
+
+
+def unpackRows(table, objects, placement, flags, rgba):
+    placement = numpy.asarray(placement, dtype=float).reshape(-1, 7)
+    flags = numpy.asarray(flags, dtype=numpy.uint8).reshape(-1)
+    rgba = numpy.asarray(rgba, dtype=float).reshape(-1, 4)
+    return StepArrays(
+        table,
+        objects,
+        placement[:, :3].copy(),
+        placement[:, 3:].copy(),
+        flags & VISIBLE > 0,
+        flags & LINK > 0,
+        flags & MATERIAL > 0,
+        rgba[:, :3].copy(),
+        rgba[:, 3].copy(),
+    )
+
+
+def encodeBlock(array, dtype):
+    return base64.b64encode(numpy.ascontiguousarray(array, dtype).tobytes())\
+        .decode('ascii')
+
+
+def decodeBlock(data, dtype):
+    return numpy.frombuffer(base64.b64decode(data), dtype)
+
+
+def align(a, b):
+    # Row of a holding each object of b, -1 where a doesn't have it
+    if a.table is b.table:
+        rows = numpy.full(len(a.table), -1, dtype=numpy.int64)
+        rows[a.objects] = numpy.arange(len(a))
+        return rows[b.objects]
+    index = {name: i for i, name in enumerate(a.names)}
+    return numpy.array([index.get(n, -1) for n in b.names], dtype=numpy.int64)
+
+
+def mergeState(base, rows, removed=()):
+    # Rows replace (or are appended to) the base state, removed are dropped
+    table = base.table
+    objects = rows.objects if rows.table is table \
+        else table.lookup(rows.names)
+    removed = {table.index.get(n) for n in removed}
+    src = {o: i for i, o in enumerate(base.objects.tolist())
+           if o not in removed}
+    src.update({o: len(base) + i for i, o in enumerate(objects.tolist())})
+    idx = numpy.array(list(src.values()), dtype=int)
+
+    def pick(a, b):
+        return numpy.concatenate([a, b])[idx]
+
+    return StepArrays(
+        table,
+        numpy.array(list(src), dtype=numpy.int64),
+        pick(base.pos, rows.pos),
+        pick(base.quat, rows.quat),
+        pick(base.visible, rows.visible),
+        pick(base.link, rows.link),
+        pick(base.material, rows.material),
+        pick(base.rgb, rows.rgb),
+        pick(base.transparency, rows.transparency),
+    )
+
+
+def changedRows(base, arrays):
+    # Rows of arrays whose state differs from (or is missing in) base
+    idx = align(base, arrays)
+    found = idx >= 0
+    idx[~found] = 0
+    if not len(base):
+        return ~found
+    if base.ids is not None and arrays.ids is not None:
+        return ~found | (base.ids[idx] != arrays.ids)
+    return ~found \
+        | numpy.any(base.pos[idx] != arrays.pos, 1) \
+        | numpy.any(base.quat[idx] != arrays.quat, 1) \
+        | (base.visible[idx] != arrays.visible) \
+        | (base.link[idx] != arrays.link) \
+        | (base.material[idx] != arrays.material) \
+        | numpy.any(base.rgb[idx] != arrays.rgb, 1) \
+        | (base.transparency[idx] != arrays.transparency)
+
+
+def diffState(base, arrays):
+    changed = changedRows(base, arrays)
+    removed = [n for n, i in zip(base.names, align(arrays, base)) if i < 0]
+    return arrays.take(numpy.flatnonzero(changed)), removed
+
+
+def packRows(arrays):
+    placement = numpy.hstack([arrays.pos, arrays.quat])
+    flags = VISIBLE * arrays.visible + LINK * arrays.link \
+        + MATERIAL * arrays.material
+    rgba = numpy.hstack([arrays.rgb, arrays.transparency[:, None]])
+    return placement, flags, rgba
+
+
+def encodeState(arrays):
+    placement, flags, rgba = packRows(arrays)
+    return {
+        'version': COMPACT,
+        'names': list(arrays.names),
+        'placement': encodeBlock(placement, '<f8'),
+        'flags': encodeBlock(flags, numpy.uint8),
+        'rgba': encodeBlock(rgba, '<f4'),
+    }
+
+
+def encodePooled(snapshot):
+    return {'version': POOLED, 'snapshot': int(snapshot)}
+
+
+def decodeState(state, pool=None):
+    # Steps of a pool share its name table, even before they are pooled
+    table = pool.table if pool is not None else None
+    if not isinstance(state.get('version'), int):
+        return packState(state, table)
+    if state['version'] > VERSION:
+        raise ValueError(f'Unsupported DocState version {state["version"]}')
+    if state['version'] == POOLED:
+        if pool is None:
+            raise ValueError('Pooled DocState without a state pool')
+        return pool.get(state['snapshot'])
+    return buildState(
+        state['names'],
+        decodeBlock(state['placement'], '<f8'),
+        decodeBlock(state['flags'], numpy.uint8),
+        decodeBlock(state['rgba'], '<f4'),
+        table,
+    )
+
+
+def stateNames(state, pool=None):
+    if not isinstance(state.get('version'), int):
+        return [v['name'] for v in state.values()]
+    if state['version'] == POOLED:
+        return pool.table.get(pool.resolve(state['snapshot'])[0])
+    return list(state['names'])
+
+
+def stateDigest(state, pool=None):
+    # Compact states hash their serialized blocks, without decoding
+    if not isinstance(state.get('version'), int):
+        return packState(state).digest()
+    h = hashlib.sha1(f'{state["version"]}'.encode())
+    if state['version'] == POOLED:
+        # Hashes the states themselves, equal steps hash equally
+        objects, ids = pool.resolve(state['snapshot'])
+        h.update('\0'.join(pool.table.get(objects)).encode())
+        for array in (pool.placement, pool.flags, pool.rgba):
+            h.update(array[ids].tobytes())
+        return h.hexdigest()
+    h.update('\0'.join(state['names']).encode())
+    for key in ('placement', 'flags', 'rgba'):
+        h.update(state[key].encode())
+    return h.hexdigest()
+
+
+class NameTable:
+    # Object names shared by the steps of an animation, referred to by
+    # their index
+
+    def __init__(self, names=()):
+        self.names = []
+        self.index = {}
+        self.lookup(names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, names):
+        # Indices of names, unknown ones are appended
+        objects = numpy.empty(len(names), dtype=numpy.int64)
+        for i, name in enumerate(names):
+            j = self.index.get(name)
+            if j is None:
+                j = self.index[name] = len(self.names)
+                self.names.append(name)
+            objects[i] = j
+        return objects
+
+    def get(self, objects):
+        return [self.names[i] for i in numpy.asarray(objects).tolist()]
+
+
+class StatePool:
+    # Every distinct object state is stored once and referenced by its id.
+    # Steps refer to snapshots, the ids of their objects stored as a diff
+    # against the snapshot of the previous step. Snapshots never change,
+    # so their ids stay valid for undo
+
+    def __init__(self, placement=None, flags=None, rgba=None, names=()):
+        self.placement = numpy.zeros((0, 7), dtype='<f8')
+        self.flags = numpy.zeros(0, dtype=numpy.uint8)
+        self.rgba = numpy.zeros((0, 4), dtype='<f4')
+        self.index = {}
+        self.table = NameTable(names)
+        # id: (parent, depth, objects, ids, removed)
+        self.snapshots = {}
+        self.next = 0
+        if placement is not None:
+            self.append(placement, flags, rgba)
+
+    def __len__(self):
+        return len(self.flags)
+
+    def nbytes(self):
+        size = self.placement.nbytes + self.flags.nbytes + self.rgba.nbytes
+        for _, _, objects, ids, removed in self.snapshots.values():
+            size += objects.nbytes + ids.nbytes + removed.nbytes
+        return size
+
+    @staticmethod
+    def rows(placement, flags, rgba):
+        rows = numpy.empty(len(flags), dtype=[
+            ('placement', '<f8', 7), ('flags', 'u1'), ('rgba', '<f4', 4)])
+        rows['placement'] = placement
+        rows['flags'] = flags
+        rows['rgba'] = rgba
+        return rows
+
+    @staticmethod
+    def keys(rows):
+        # The raw bytes of each row, so equal states hash equally
+        return rows.view(f'V{rows.dtype.itemsize}').tolist()
+
+    def append(self, placement, flags, rgba):
+        rows = self.rows(placement, flags, rgba)
+        start = len(self)
+        for i, row in enumerate(self.keys(rows)):
+            self.index.setdefault(row, start + i)
+        self.placement = numpy.concatenate([self.placement,
+                                            rows['placement']])
+        self.flags = numpy.concatenate([self.flags, rows['flags']])
+        self.rgba = numpy.concatenate([self.rgba, rows['rgba']])
+
+    def intern(self, arrays):
+        if arrays.table is not self.table:
+            arrays.objects = self.table.lookup(arrays.names)
+            arrays.table = self.table
+        rows = self.rows(*packRows(arrays))
+        ids = numpy.empty(len(rows), dtype=numpy.int64)
+        new = {}
+        first = []
+        for i, row in enumerate(self.keys(rows)):
+            id = self.index.get(row, new.get(row))
+            if id is None:
+                id = new[row] = len(self) + len(new)
+                first.append(i)
+            ids[i] = id
+        if first:
+            rows = rows[first]
+            self.append(rows['placement'], rows['flags'], rows['rgba'])
+        arrays.ids = ids
+        return ids
+
+    def take(self, objects, ids):
+        arrays = unpackRows(self.table, objects, self.placement[ids],
+                            self.flags[ids], self.rgba[ids])
+        arrays.ids = ids
+        return arrays
+
+    def expand(self, snapshot):
+        # State id of every object of the name table, -1 if absent
+        chain = []
+        while snapshot >= 0:
+            chain.append(self.snapshots[snapshot])
+            snapshot = chain[-1][0]
+        rows = numpy.full(len(self.table), -1, dtype=numpy.int64)
+        for _, _, objects, ids, removed in reversed(chain):
+            rows[objects] = ids
+            rows[removed] = -1
+        return rows
+
+    def resolve(self, snapshot):
+        # Objects of the snapshot, in name table order, and their ids
+        rows = self.expand(snapshot)
+        objects = numpy.flatnonzero(rows >= 0)
+        return objects, rows[objects]
+
+    def get(self, snapshot):
+        return self.take(*self.resolve(snapshot))
+
+    def snapshot(self, arrays, parent=-1):
+        # Interns arrays, returns the id of a snapshot holding them
+        ids = self.intern(arrays)
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        depth = self.snapshots[parent][1] + 1 if parent >= 0 else 0
+        if depth >= KEYFRAME_INTERVAL:
+            parent, depth = -1, 0
+        if parent < 0:
+            entry = (-1, 0, arrays.objects.copy(), ids.copy(), empty)
+        else:
+            base = self.expand(parent)
+            present = numpy.zeros(len(self.table), dtype=bool)
+            present[arrays.objects] = True
+            changed = base[arrays.objects] != ids
+            removed = numpy.flatnonzero(~present & (base >= 0))
+            if not changed.any() and not len(removed):
+                return parent
+            entry = (parent, depth, arrays.objects[changed], ids[changed],
+                     removed)
+        snapshot = self.next
+        self.snapshots[snapshot] = entry
+        self.next += 1
+        return snapshot
+
+    def encode(self, used=None):
+        # Only what the used snapshots need is written, with the states
+        # numbered again. Snapshot ids are kept
+        keep = set()
+        for snapshot in self.snapshots if used is None else used:
+            while snapshot >= 0 and snapshot not in keep:
+                keep.add(snapshot)
+                snapshot = self.snapshots[snapshot][0]
+        keep = sorted(keep)
+        entries = [self.snapshots[i] for i in keep]
+        states = numpy.unique(numpy.concatenate(
+            [numpy.zeros(0, dtype=numpy.int64)] +
+            [entry[3] for entry in entries]))
+        remap = numpy.full(len(self), -1, dtype=numpy.int64)
+        remap[states] = numpy.arange(len(states))
+        return {
+            'version': POOLED,
+            'placement': encodeBlock(self.placement[states], '<f8'),
+            'flags': encodeBlock(self.flags[states], numpy.uint8),
+            'rgba': encodeBlock(self.rgba[states], '<f4'),
+            'names': list(self.table.names),
+            'snapshots': [{
+                'id': i,
+                'parent': parent,
+                'depth': depth,
+                'objects': encodeBlock(objects, '<u4'),
+                'ids': encodeBlock(remap[ids], '<u4'),
+                'removed': encodeBlock(removed, '<u4'),
+            } for i, (parent, depth, objects, ids, removed)
+                in zip(keep, entries)],
+            'next': self.next,
+        }
+
+    @staticmethod
+    def decode(state):
+        if not state:
+            return StatePool()
+        if state.get('version') != POOLED:
+            raise ValueError(f'Unsupported StatePool version '
+                             f'{state.get("version")}')
+        pool = StatePool(
+            decodeBlock(state['placement'], '<f8').reshape(-1, 7),
+            decodeBlock(state['flags'], numpy.uint8),
+            decodeBlock(state['rgba'], '<f4').reshape(-1, 4),
+            state['names'],
+        )
+        for entry in state['snapshots']:
+            pool.snapshots[entry['id']] = (
+                entry['parent'],
+                entry['depth'],
+                decodeBlock(entry['objects'], '<u4').astype(numpy.int64),
+                decodeBlock(entry['ids'], '<u4').astype(numpy.int64),
+                decodeBlock(entry['removed'], '<u4').astype(numpy.int64),
+            )
+        pool.next = state['next']
+        return pool
+
+
+class Frame:
+
+    def __init__(self, names, link, material, pos, quat, rgb, transparency,
+                 driven=None):
+        self.names = names
+        self.link = link
+        self.material = material
+        self.pos = pos
+        self.quat = quat
+        self.rgb = rgb
+        self.transparency = transparency
+        self.driven = driven
+
+    def __len__(self):
+        return len(self.pos) if self.pos.ndim == 3 else 1
+
+
+class Segment:
+
+    def __init__(self, a, b):
+        # Objects are driven by the target step, like Step.anim always did
+        self.names = b.names
+        idx = align(a, b)
+        found = idx >= 0
+        idx[~found] = 0
+
+        def take(xa, xb):
+            if not len(xa):
+                return xb.copy()
+            mask = found.reshape((-1,) + (1,) * (xb.ndim - 1))
+            return numpy.where(mask, xa[idx], xb)
+
+        has0, rgb0, t0 = a.effectiveMaterial()
+        has1, rgb1, t1 = b.effectiveMaterial()
+        self.link = b.link
+        self.material = b.link & (take(has0, has1) | has1)
+        self.pos0 = take(a.pos, b.pos)
+        self.pos1 = b.pos
+        self.rgb0 = take(rgb0, rgb1)
+        self.rgb1 = rgb1
+        self.t0 = take(t0, t1)
+        self.t1 = t1
+        self.q0 = take(a.quat, b.quat)
+        q1 = b.quat.copy()
+        # Rotation is simplified to the shorter path
+        dot = numpy.sum(self.q0 * q1, 1)
+        q1[dot < 0] *= -1
+        self.q1 = q1
+        self.theta = numpy.arccos(numpy.clip(numpy.abs(dot), -1, 1))
+        self.small = self.theta < 1e-6
+        self.sin = numpy.where(self.small, 1, numpy.sin(self.theta))
+        # Change index: only objects whose state differs need to be driven
+        if a.ids is not None and b.ids is not None:
+            self.changed = ~found | (a.ids[idx] != b.ids)
+        else:
+            self.changed = ~found \
+                | numpy.any(self.pos0 != self.pos1, 1) \
+                | numpy.any(self.q0 != self.q1, 1) \
+                | self.material & (numpy.any(self.rgb0 != self.rgb1, 1)
+                                   | (self.t0 != self.t1))
+
+    def __len__(self):
+        return len(self.names)
+
+    def slerp(self, t):
+        w0 = numpy.where(self.small, 1 - t,
+                         numpy.sin((1 - t) * self.theta) / self.sin)
+        w1 = numpy.where(self.small, t, numpy.sin(t * self.theta) / self.sin)
+        q = w0[..., None] * self.q0 + w1[..., None] * self.q1
+        return q / numpy.linalg.norm(q, axis=-1)[..., None]
+
+    def frame(self, delta):
+        # delta may be a scalar (one frame) or an array (a batch of frames)
+        d = numpy.asarray(delta, dtype=float)[..., None]
+        return Frame(
+            self.names,
+            self.link,
+            self.material,
+            self.pos0 + (self.pos1 - self.pos0) * d[..., None],
+            self.slerp(d),
+            self.rgb0 + (self.rgb1 - self.rgb0) * d[..., None],
+            self.t0 + (self.t1 - self.t0) * d,
+        )
+
+
+class Timeline:
+
+    def __init__(self, durations, fps):
+        # Segment i runs from starts[i] to starts[i + 1] seconds
+        self.durations = numpy.asarray(durations, dtype=float).reshape(-1)
+        self.starts = numpy.concatenate([[0], numpy.cumsum(self.durations)])
+        self.duration = float(self.starts[-1])
+        self.fps = fps
+        # Frames are laid out on one global clock, the last one is the end
+        count = int(round(self.duration * fps)) + 1 if len(self.durations) \
+            else 0
+        self.times = numpy.arange(count) / fps
+        if count:
+            self.times[-1] = self.duration
+        self.segments, self.deltas = self.locate(self.times)
+
+    def __len__(self):
+        return len(self.times)
+
+    def locate(self, t):
+        # Segment and interpolation delta at time t, scalar or array
+        t = numpy.clip(numpy.asarray(t, dtype=float), 0, self.duration)
+        last = len(self.durations) - 1
+        segment = numpy.searchsorted(self.starts[1:-1], t, side='right')
+        segment = numpy.minimum(segment, max(last, 0))
+        if not len(self.durations):
+            return segment, numpy.zeros_like(t)
+        start = self.starts[segment]
+        duration = self.durations[segment]
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            delta = numpy.where(duration > 0, (t - start) / duration, 1)
+        return segment, numpy.clip(delta, 0, 1)
+
+    def segment(self, i):
+        # Interpolation deltas of the frames that belong to segment i
+        return self.deltas[self.segments == i]
+
+
+# Step sort keys are strings compared digit by digit, a key between any
+# two others always exists, so no step is ever renumbered
+KEY_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def keyBetween(lo='', hi=None):
+    # Key after lo and before hi, None is past every key. Keys never end
+    # with the first digit, so '' sorts before all of them. Appended keys
+    # step by one digit and grow a digit every len(KEY_DIGITS) steps
+    if hi is not None:
+        n = 0
+        while (lo[n:n + 1] or KEY_DIGITS[0]) == hi[n]:
+            n += 1
+        if n:
+            return hi[:n] + keyBetween(lo[n:], hi[n:])
+    a = KEY_DIGITS.index(lo[0]) if lo else 0
+    b = KEY_DIGITS.index(hi[0]) if hi is not None else len(KEY_DIGITS)
+    if hi is None and a + 1 < b:
+        return KEY_DIGITS[a + 1]
+    if b - a > 1:
+        return KEY_DIGITS[(a + b) // 2]
+    if hi is not None and len(hi) > 1:
+        return hi[0]
+    return KEY_DIGITS[a] + keyBetween(lo[1:])
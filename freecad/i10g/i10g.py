@@ -1,16 +1,32 @@
 import os
 import re
+import sys
+import json
 import time
-import copy
+import queue
+import bisect
 import numpy
+import shutil
+import hashlib
+import tempfile
+import threading
 import subprocess
+import contextlib
+import collections
+import concurrent.futures
 import FreeCAD as App
 import FreeCADGui as Gui
 from freecad.i10g import ICONPATH
+from freecad.i10g import engine
+from freecad.i10g import bake
+from freecad.i10g import cache
+from freecad.i10g import profiler
 
 
 IGNORELIST = ['App::Origin', 'App::Line', 'App::Plane']
 
+TRACKED = ['App::Link', 'App::Part']
+
 DEF_RES = [
     '320x240',
     '640x480',
@@ -34,6 +50,8 @@ DEF_RES = [
     '15360x8640',
 ]
 
+CAPTURES = ['SaveImage', 'Framebuffer', 'Offscreen']
+
 STATE = {
     'step': 0,
     'render': False,
@@ -41,6 +59,7 @@ STATE = {
     'animation': None,
     'selObs': None,
     'docObs': None,
+    'viewObs': None,
     'doc': None,
     'GUIFPS': 24,
 }
@@ -67,25 +86,16 @@ def err(msg):
 
 
 def createObjState(obj):
-    pos = str(obj.Placement.Matrix).split('Matrix')[1]
-    pos = pos.translate({ord(c):'' for c in ' ()'})
-    pos = [float(i) for i in pos.split(',')]
-    assert len(pos) == 16, f'Failed parsing: {str(obj.Placement.Matrix)}'
-    color = None
-    material = None
-    transparency = 0
+    p = obj.Placement
+    flags = engine.VISIBLE * bool(obj.Visibility)
+    rgba = engine.DEFAULT_COLOR + (0,)
     if obj.TypeId == 'App::Link':
-        material = obj.ViewObject.OverrideMaterial
-        color = list(obj.ViewObject.ShapeMaterial.DiffuseColor)[:3]
-        transparency = obj.ViewObject.ShapeMaterial.Transparency
-    return {
-        'name': obj.Name,
-        'pos': pos,
-        'visible': obj.Visibility,
-        'material': material,
-        'color': color,
-        'transparency': transparency,
-    }
+        flags |= engine.LINK
+        if obj.ViewObject.OverrideMaterial:
+            flags |= engine.MATERIAL
+        m = obj.ViewObject.ShapeMaterial
+        rgba = tuple(m.DiffuseColor)[:3] + (m.Transparency,)
+    return tuple(p.Base) + tuple(p.Rotation.Q), flags, rgba
 
 
 def newMaterial(color=None, transparency=None):
@@ -100,69 +110,283 @@ def newMaterial(color=None, transparency=None):
     return m
 
 
-def interpolate(v1, v2, delta):
-    return v1 + (v2 - v1)*delta
-
+class MaterialPool:
+
+    def __init__(self, size=512, levels=255):
+        self.size = size
+        self.levels = levels
+        self.pool = collections.OrderedDict()
+        self.assigned = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, color=None, transparency=None):
+        color = tuple(color or engine.DEFAULT_COLOR)[:3]
+        return tuple(round(float(c) * self.levels)
+                     for c in color + (transparency or 0,))
+
+    def get(self, key):
+        m = self.pool.get(key)
+        if m is None:
+            self.misses += 1
+            m = newMaterial([c / self.levels for c in key[:3]],
+                            key[3] / self.levels)
+            self.pool[key] = m
+            while len(self.pool) > self.size:
+                self.pool.popitem(last=False)
+        else:
+            self.hits += 1
+            self.pool.move_to_end(key)
+        return m
+
+    def assign(self, obj, color=None, transparency=None, override=True):
+        # Skips the assignment (and the Coin update) if nothing changed
+        key = self.key(color, transparency)
+        vobj = obj.ViewObject
+        if self.assigned.get(obj.Name) == key and \
+                vobj.OverrideMaterial == override:
+            return False
+        if vobj.OverrideMaterial != override:
+            vobj.OverrideMaterial = override
+        vobj.ShapeMaterial = self.get(key)
+        self.assigned[obj.Name] = key
+        return True
+
+    def forget(self):
+        self.assigned.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self.pool),
+            'hits': self.hits,
+            'misses': self.misses,
+            'ratio': self.hits / total if total else 0,
+        }
+
+
+MATERIALS = MaterialPool()
+
+
+def applyState(objs, arrays):
+    pos = arrays.pos.tolist()
+    quat = arrays.quat.tolist()
+    rgb = arrays.rgb.tolist()
+    transparency = arrays.transparency.tolist()
+    for i, obj in enumerate(objs):
+        if not obj:
+            continue
+        obj.Placement = App.Placement(App.Vector(*pos[i]),
+                                      App.Rotation(*quat[i]))
+        obj.Visibility = bool(arrays.visible[i])
+        if obj.TypeId == 'App::Link' and arrays.link[i]:
+            if arrays.material[i]:
+                MATERIALS.assign(obj, rgb[i], transparency[i])
+            else:
+                MATERIALS.assign(obj, override=False)
+
+
+def applyFrame(objs, frame):
+    if frame.driven is None:
+        idx = numpy.arange(len(objs))
+    else:
+        idx = numpy.flatnonzero(frame.driven)
+    pos = frame.pos[idx].tolist()
+    quat = frame.quat[idx].tolist()
+    rgb = frame.rgb[idx].tolist()
+    transparency = frame.transparency[idx].tolist()
+    written = []
+    for j, i in enumerate(idx.tolist()):
+        obj = objs[i]
+        if not obj:
+            continue
+        written.append(obj)
+        obj.Placement = App.Placement(App.Vector(*pos[j]),
+                                      App.Rotation(*quat[j]))
+        if not frame.link[i]:
+            continue
+        if frame.material[i]:
+            if not obj.Visibility:
+                obj.Visibility = True
+            MATERIALS.assign(obj, rgb[j], transparency[j])
+        elif obj.ViewObject.OverrideMaterial:
+            MATERIALS.assign(obj, override=False)
+    return written
+
+
+@contextlib.contextmanager
+def frameTransaction(view=None):
+    # Groups the writes of a frame: the scene is redrawn once and nothing
+    # is left touched, so no recompute is needed afterwards
+    root = view.getSceneGraph() if view else None
+    if root:
+        root.enableNotify(False)
+    written = []
+    try:
+        yield written
+    finally:
+        for obj in written:
+            obj.purgeTouched()
+        if root:
+            root.enableNotify(True)
+            root.touch()
+
+
+class DocumentBackend:
+    # Writes every frame to the document properties
+
+    def __init__(self, objs, view=None):
+        self.objs = objs
+        self.view = view
+
+    def apply(self, frame):
+        with frameTransaction(self.view) as written:
+            written += applyFrame(self.objs, frame)
+
+    def close(self):
+        pass
 
-def interpolateMaterial(s1, s2, delta):
-    r = interpolate(s1.DiffuseColor[0], s2.DiffuseColor[0], delta)
-    g = interpolate(s1.DiffuseColor[1], s2.DiffuseColor[1], delta)
-    b = interpolate(s1.DiffuseColor[2], s2.DiffuseColor[2], delta)
-    t = interpolate(s1.Transparency, s2.Transparency, delta)
-    return newMaterial((r, g, b), t)
 
+class CoinBackend:
+    # Drives the view providers' scene graph, the document is untouched
 
-def applyObjState(state):
-    obj = Doc().getObject(state['name'])
-    if not obj:
-        return
-    obj.Placement = state['pos'].copy()
-    obj.Visibility = state['visible']
-    if obj.TypeId == 'App::Link' and 'material' in state:
-        if state['material']:
-            obj.ViewObject.OverrideMaterial = True
-            obj.ViewObject.ShapeMaterial = state['material']
+    def __init__(self, objs, view=None):
+        from pivy import coin
+        self.coin = coin
+        self.view = view
+        self.nodes = []
+        self.hidden = []
+        for obj in objs:
+            vobj = obj and obj.ViewObject
+            if not vobj:
+                self.nodes.append(None)
+                continue
+            root = vobj.RootNode
+            transform = None
+            kind = coin.SoTransform.getClassTypeId()
+            for i in range(root.getNumChildren()):
+                if root.getChild(i).isOfType(kind):
+                    transform = root.getChild(i)
+                    break
+            saved = None
+            if transform is None:
+                transform = coin.SoTransform()
+                root.insertChild(transform, 0)
+            else:
+                saved = (transform.translation.getValue(),
+                         transform.rotation.getValue())
+            self.nodes.append([root, transform, saved, None, obj])
+
+    def material(self, node):
+        if node[3] is None:
+            material = self.coin.SoMaterial()
+            material.setOverride(True)
+            index = node[0].findChild(node[1]) + 1
+            node[0].insertChild(material, index)
+            node[3] = material
+            obj = node[4]
+            if not obj.Visibility:
+                # Hidden objects fade in through their material
+                obj.ViewObject.show()
+                self.hidden.append(obj)
+        return node[3]
+
+    def apply(self, frame):
+        if frame.driven is None:
+            idx = numpy.arange(len(self.nodes))
         else:
-            obj.ViewObject.OverrideMaterial = False
-            obj.ViewObject.ShapeMaterial = newMaterial()
-
-
-def animObjState(obj, s1, s2, delta):
-    if not obj:
-        return
-    obj.Placement = s1['pos'].slerp(s2['pos'], delta)
-    m1 = s1.get('material')
-    m2 = s2.get('material')
-    if s1['visible'] == False and not m1:
-        m1 = newMaterial(None, 1)
-    if s2['visible'] == False and not m2:
-        m2 = newMaterial(None, 1)
-    if obj.TypeId == 'App::Link':
-        if m1 or m2:
-            obj.Visibility = True
-            obj.ViewObject.OverrideMaterial = True
-            obj.ViewObject.ShapeMaterial = interpolateMaterial(
-                m1 or newMaterial(),
-                m2 or newMaterial(),
-                delta
-            )
-        elif obj.ViewObject.OverrideMaterial:
-            obj.ViewObject.OverrideMaterial = False
-            obj.ViewObject.ShapeMaterial = newMaterial()
-
+            idx = numpy.flatnonzero(frame.driven)
+        pos = frame.pos[idx].tolist()
+        quat = frame.quat[idx].tolist()
+        rgb = frame.rgb[idx].tolist()
+        transparency = frame.transparency[idx].tolist()
+        root = self.view.getSceneGraph() if self.view else None
+        if root:
+            root.enableNotify(False)
+        try:
+            for j, i in enumerate(idx.tolist()):
+                node = self.nodes[i]
+                if node is None:
+                    continue
+                node[1].translation.setValue(*pos[j])
+                node[1].rotation.setValue(*quat[j])
+                if frame.link[i] and frame.material[i]:
+                    material = self.material(node)
+                    material.diffuseColor.setValue(*rgb[j])
+                    material.transparency.setValue(transparency[j])
+                    material.setOverride(True)
+                    material.diffuseColor.setIgnored(False)
+                    material.transparency.setIgnored(False)
+                elif node[3] is not None:
+                    node[3].setOverride(False)
+                    node[3].diffuseColor.setIgnored(True)
+                    node[3].transparency.setIgnored(True)
+        finally:
+            if root:
+                root.enableNotify(True)
+                root.touch()
+
+    def close(self):
+        # Puts the scene back exactly as the document describes it
+        for node in self.nodes:
+            if node is None:
+                continue
+            root, transform, saved, material, _ = node
+            if saved is None:
+                root.removeChild(transform)
+            else:
+                transform.translation.setValue(saved[0])
+                transform.rotation.setValue(saved[1])
+            if material is not None:
+                root.removeChild(material)
+        for obj in self.hidden:
+            obj.ViewObject.hide()
+        self.nodes = []
+        self.hidden = []
+
+
+BACKENDS = {
+    'Document': DocumentBackend,
+    'Coin': CoinBackend,
+}
 
-def getState():
-    objs = Doc().findObjects()
-    state = {}
 
+def isTracked(obj):
+    return obj.TypeId in TRACKED and hasattr(obj, 'Placement')
+
+
+def captureState(base=None, dirty=None):
+    names, placement, flags, rgba = [], [], [], []
+    removed = []
+    if base is None:
+        objs = []
+        for obj in Doc().findObjects():
+            if hasattr(obj, 'Placement') and obj.TypeId not in IGNORELIST:
+                if obj.TypeId not in TRACKED:
+                    warn(f'warning: found {obj.FullName} as {obj.TypeId}')
+                    continue
+                objs.append(obj)
+    else:
+        # Only re-read what changed since the base state was applied
+        objs = [Doc().getObject(name) for name in dirty]
+        removed = [n for n, o in zip(dirty, objs) if not o or not isTracked(o)]
+        objs = [o for o in objs if o and isTracked(o)]
     for obj in objs:
-        if hasattr(obj, 'Placement') and obj.TypeId not in IGNORELIST:
-            if obj.TypeId not in ['App::Link', 'App::Part']:
-                warn(f'warning: found {obj.FullName} as {obj.TypeId}')
-                continue
-            state[obj.Name] = createObjState(obj)
-    log(f'state: {state}')
-    return state
+        p, f, c = createObjState(obj)
+        names.append(obj.Name)
+        placement.append(p)
+        flags.append(f)
+        rgba.append(c)
+    log(f'state: {len(names)} objects read')
+    arrays = engine.buildState(names, placement, flags, rgba,
+                               None if base is None else base.table)
+    if base is None:
+        return arrays
+    return engine.mergeState(base, arrays, removed)
+
+
+def getState():
+    return engine.encodeState(captureState())
 
 
 def newProp(obj, name, type_, value, subsection='', tooltip='', default=None):
@@ -173,19 +397,166 @@ def newProp(obj, name, type_, value, subsection='', tooltip='', default=None):
     return True
 
 
-def getDeltas(frames, last=False):
-    array = numpy.arange(0, 1, 1 / frames)
-    if last:
-        array = numpy.append(array, 1)
-    return array
+def newEnum(obj, name, values, subsection='', tooltip=''):
+    if newProp(obj, name, 'Enumeration', values, subsection, tooltip):
+        return True
+    # Extends enumerations saved by older versions
+    value = obj.getPropertyByName(name)
+    if obj.getEnumerationsOfProperty(name) != values:
+        setattr(obj, name, values)
+        setattr(obj, name, value)
+    return False
+
+
+def getActiveView():
+    doc = Gui.activeDocument() if Gui.getMainWindow() else None
+    view = doc and doc.activeView()
+    return view if hasattr(view, 'getSceneGraph') else None
+
+
+def grabFramebuffer(view, w, h):
+    from PySide import QtCore, QtGui
+    widget = view.graphicsView().viewport()
+    if hasattr(widget, 'grabFramebuffer'):
+        img = widget.grabFramebuffer()
+    elif hasattr(widget, 'grabFrameBuffer'):
+        img = widget.grabFrameBuffer()
+    else:
+        img = widget.grab().toImage()
+    if img.width() != w or img.height() != h:
+        img = img.scaled(w, h, QtCore.Qt.IgnoreAspectRatio,
+                         QtCore.Qt.SmoothTransformation)
+    img = img.convertToFormat(QtGui.QImage.Format_RGB888)
+    size = img.sizeInBytes() if hasattr(img, 'sizeInBytes') \
+        else img.byteCount()
+    # Scanlines are padded to 32 bits
+    data = numpy.frombuffer(img.constBits(), numpy.uint8, size)
+    return data.reshape(h, img.bytesPerLine())[:, :w * 3].tobytes()
+
+
+def getBackgroundColor(bg):
+    if bg == 'Black':
+        return (0.0, 0.0, 0.0)
+    if bg in ('White', 'Transparent'):
+        return (1.0, 1.0, 1.0)
+    params = App.ParamGet('User parameter:BaseApp/Preferences/View')
+    c = params.GetUnsigned('BackgroundColor', 0x336699ff)
+    return tuple(((c >> s) & 0xff) / 255 for s in (24, 16, 8))
+
+
+def readCamera(text):
+    from pivy import coin
+    inp = coin.SoInput()
+    inp.setBuffer(text)
+    root = coin.SoDB.readAll(inp)
+    if root and root.getNumChildren():
+        return root.getChild(0)
+    return None
+
+
+class OffscreenRenderer:
+
+    def __init__(self, w, h, bg='Current', view=None, camera=''):
+        from pivy import coin
+        self.coin = coin
+        self.w = w
+        self.h = h
+        self.alpha = bg == 'Transparent'
+        region = coin.SbViewportRegion(w, h)
+        self.renderer = coin.SoOffscreenRenderer(region)
+        if self.alpha:
+            self.renderer.setComponents(
+                coin.SoOffscreenRenderer.RGB_TRANSPARENCY)
+        else:
+            self.renderer.setComponents(coin.SoOffscreenRenderer.RGB)
+        self.renderer.setBackgroundColor(
+            coin.SbColor(*getBackgroundColor(bg)))
+        self.root = coin.SoSeparator()
+        self.root.ref()
+        if view:
+            # Same camera and scene as the active 3D view
+            self.camera = view.getCameraNode()
+            scene = view.getSceneGraph()
+        else:
+            self.camera = camera and readCamera(camera)
+            scene = coin.SoSeparator()
+            for obj in Doc().Objects:
+                vobj = obj.ViewObject
+                if vobj and not obj.getParentGeoFeatureGroup():
+                    scene.addChild(vobj.RootNode)
+        if not self.camera:
+            self.camera = coin.SoOrthographicCamera()
+            self.camera.orientation = coin.SbRotation(
+                coin.SbVec3f(0, 0, 1), coin.SbVec3f(1, 1, 1))
+            self.camera.viewAll(scene, region)
+        self.light = coin.SoDirectionalLight()
+        self.root.addChild(self.camera)
+        self.root.addChild(self.light)
+        self.root.addChild(scene)
+
+    def render(self):
+        # Headlight follows the camera, like in the 3D view
+        rotation = self.camera.orientation.getValue()
+        direction = rotation.multVec(self.coin.SbVec3f(1, -1, -10))
+        self.light.direction.setValue(direction)
+        self.renderer.render(self.root)
+        c = 4 if self.alpha else 3
+        data = numpy.frombuffer(self.renderer.getBuffer(), numpy.uint8,
+                                self.w * self.h * c)
+        # Coin buffers start from the bottom row
+        return data.reshape(self.h, self.w * c)[::-1].tobytes()
+
+    def close(self):
+        self.root.unref()
+
+
+def getWorkerCommand():
+    # Inside FreeCAD sys.executable is the FreeCAD binary, not Python
+    home = App.getHomePath()
+    python = sys.executable
+    if not os.path.basename(python).lower().startswith('python'):
+        candidates = [os.path.join(home, 'bin', name)
+                      for name in ('python', 'python3', 'python.exe')]
+        python = next((c for c in candidates if os.path.isfile(c)),
+                      shutil.which('python3') or 'python3')
+    root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+    env = dict(os.environ)
+    paths = [os.path.join(home, 'lib'), os.path.join(home, 'Ext'), root]
+    if env.get('PYTHONPATH'):
+        paths.append(env['PYTHONPATH'])
+    env['PYTHONPATH'] = os.pathsep.join(paths)
+    return [python, '-m', 'freecad.i10g.render'], env
+
+
+def printProgress(count, total, dt):
+    if count % 10 == 0:
+        left = (total * dt)/(count) - dt
+        fmt = '{:0>2.0f}:{:0>2.0f}'.format(left//60, left%60)
+        print(f'{fmt} remaining')
+        Gui.updateGui()
 
 
 class VideoRenderer:
 
-    def __init__(self, ffmpeg):
+    def __init__(self, ffmpeg, capture='SaveImage', camera='', progress=None,
+                 palette=None, reusePalette=False, stats=None, buffer=8):
         self.ffmpeg = ffmpeg
+        self.stats = stats or profiler.Profiler()
+        # Raw frames are written by a background thread, capture blocks
+        # only once buffer frames are waiting for the encoder
+        self.buffer = buffer
+        self.queue = None
+        self.writer = None
+        self.error = None
+        self.capture = capture
+        self.camera = camera
+        self.progress = progress
+        self.palette = palette
+        self.reusePalette = reusePalette
         self.pipein, self.pipeout = (None, None)
-        self.tmpfile = '/tmp/stream.png'
+        self.tmpdir = None
+        self.tmpfile = None
+        self.offscreen = None
         self.start = 0
 
     def begin(self, name, w=300, h=300, bg='Current', framerate=24, more=''):
@@ -196,39 +567,296 @@ class VideoRenderer:
         self.count = 0
         self.start = time.time()
 
-        self.pipein, self.pipeout = os.pipe()
-        pid = os.getpid()
-        if os.path.exists(self.tmpfile):
-            os.remove(self.tmpfile)
-        os.symlink(f'/proc/{pid}/fd/{self.pipein}', self.tmpfile)
-
-        params = f'{self.ffmpeg} -y -f image2pipe -framerate {framerate} -i '
-        params += f'/proc/{pid}/fd/{self.pipeout} -vcodec png '
-        params += more
-        params += self.filename
-
-        self.p = subprocess.Popen(params.split(), stdin=None)
+        if self.capture == 'SaveImage':
+            self.pipein, self.pipeout = os.pipe()
+            pid = os.getpid()
+            self.tmpdir = tempfile.mkdtemp(prefix='i10g')
+            self.tmpfile = os.path.join(self.tmpdir, 'stream.png')
+            os.symlink(f'/proc/{pid}/fd/{self.pipein}', self.tmpfile)
+            params = [self.ffmpeg, '-y', '-f', 'image2pipe',
+                      '-framerate', f'{framerate}',
+                      '-i', f'/proc/{pid}/fd/{self.pipeout}']
+        else:
+            pixfmt = 'rgb24'
+            if self.capture == 'Offscreen':
+                view = getActiveView()
+                self.offscreen = OffscreenRenderer(w, h, bg, view,
+                                                   self.camera)
+                if self.offscreen.alpha:
+                    pixfmt = 'rgba'
+            elif bg != 'Current':
+                warn(f'{self.capture} capture ignores the {bg} background')
+            params = [self.ffmpeg, '-y', '-f', 'rawvideo', '-pix_fmt', pixfmt,
+                      '-s', f'{w}x{h}', '-framerate', f'{framerate}',
+                      '-i', '-']
+        params += self.getOutputArgs(more)
+
+        stdin = None if self.tmpdir else subprocess.PIPE
+        self.p = subprocess.Popen(params, stdin=stdin)
+        if stdin:
+            self.queue = queue.Queue(self.buffer)
+            self.writer = threading.Thread(target=self.write, daemon=True)
+            self.writer.start()
+
+    def write(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            try:
+                with self.stats.phase('write'):
+                    self.p.stdin.write(data)
+            except OSError as e:
+                self.error = e
+                break
 
-    def addFrame(self, total):
-        view = Gui.activeDocument().activeView()
-        view.saveImage(self.tmpfile, self.w, self.h, self.bg)
+    def push(self, data):
+        # Backpressure: wait for the writer, but keep the GUI responsive
+        with self.stats.phase('queue'):
+            while True:
+                if not self.writer.is_alive():
+                    self.error = self.error or BrokenPipeError(
+                        'FFmpeg stopped reading frames')
+                    raise self.error
+                try:
+                    self.queue.put(data, timeout=0.05)
+                    return
+                except queue.Full:
+                    if Gui.getMainWindow():
+                        Gui.updateGui()
+
+    def getOutputArgs(self, more=''):
+        if os.path.splitext(self.filename)[1].lower() != '.gif':
+            return ['-vcodec', 'png'] + more.split() + [self.filename]
+        palette = self.palette
+        if palette and self.reusePalette and os.path.exists(palette):
+            return ['-i', palette, '-filter_complex', '[0:v][1:v]paletteuse'] \
+                + more.split() + [self.filename]
+        # The palette is computed from the same frame stream, in one pass
+        graph = '[0:v]split[a][b];[a]palettegen,split[p][q];[b][p]paletteuse'
+        if not palette:
+            graph = '[0:v]split[a][b];[a]palettegen[p];[b][p]paletteuse'
+            return ['-filter_complex', graph] + more.split() + [self.filename]
+        return ['-filter_complex', f'{graph}[out]', '-map', '[out]'] \
+            + more.split() + [self.filename, '-map', '[q]', '-update', '1',
+                              palette]
+
+    def getFrameSize(self):
+        # Size of a raw frame, SaveImage frames are PNGs and have none
+        if self.capture == 'SaveImage':
+            return None
+        alpha = self.offscreen and self.offscreen.alpha
+        return self.w * self.h * (4 if alpha else 3)
+
+    def addFrame(self, total, data=None):
+        # data is a raw frame rendered before, otherwise one is captured
+        with self.stats.phase('capture'):
+            if data is not None:
+                pass
+            elif self.offscreen:
+                data = self.offscreen.render()
+            elif self.capture == 'SaveImage':
+                # The PNG is written to the pipe, so this includes 'write'
+                view = Gui.activeDocument().activeView()
+                view.saveImage(self.tmpfile, self.w, self.h, self.bg)
+            else:
+                view = Gui.activeDocument().activeView()
+                data = grabFramebuffer(view, self.w, self.h)
+        if data is not None:
+            self.push(data)
         self.count += 1
-        if self.count % 10 == 0:
-            dt = time.time() - self.start
-            left = (total * dt)/(self.count) - dt
-            fmt = '{:0>2.0f}:{:0>2.0f}'.format(left//60, left%60)
-            print(f'{fmt} remaining')
-            Gui.updateGui()
+        (self.progress or printProgress)(self.count, total,
+                                         time.time() - self.start)
+        return data
 
     def end(self):
-        os.close(self.pipein)
-        os.close(self.pipeout)
-        self.p.wait()
-        os.remove(self.tmpfile)
+        if self.tmpdir:
+            os.close(self.pipein)
+            os.close(self.pipeout)
+        with self.stats.phase('encode'):
+            # The writer may have stopped with a full queue
+            while self.writer and self.writer.is_alive():
+                try:
+                    self.queue.put(None, timeout=0.05)
+                    break
+                except queue.Full:
+                    pass
+            if self.writer:
+                self.writer.join()
+                self.writer = None
+            if self.p.stdin:
+                try:
+                    self.p.stdin.close()
+                except OSError:
+                    pass
+            self.p.wait()
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir)
+            self.tmpdir = None
+        if self.offscreen:
+            self.offscreen.close()
+            self.offscreen = None
         dt = time.time() - self.start
-        fps = '{:.0f}'.format(self.count/dt)
-        dt = '{:0>2.0f}:{:0>2.0f}'.format(dt//60, dt%60)
-        print(f'Exported {self.count} frames in {dt} ({fps} fps)')
+        stats = {
+            'frames': self.count,
+            'seconds': dt,
+            'fps': self.count / dt if dt else 0,
+            'returncode': self.p.returncode or int(self.error is not None),
+        }
+        if not self.progress:
+            fps = '{:.0f}'.format(stats['fps'])
+            dt = '{:0>2.0f}:{:0>2.0f}'.format(dt//60, dt%60)
+            print(f'Exported {self.count} frames in {dt} ({fps} fps)')
+        return stats
+
+
+class StepStore:
+    # Hydrated steps and the objects they refer to, the least recently used
+    # steps go back to their DocState once the budget (in MB) is exceeded
+
+    def __init__(self, budget=256):
+        self.budget = budget * 1024 * 1024
+        self.steps = collections.OrderedDict()
+        self.total = 0
+        # Name table of the hydrated steps, objects are resolved once
+        self.table = engine.NameTable()
+        self.objects = {}
+
+    def setTable(self, table):
+        self.table = table
+        self.objects.clear()
+
+    def getObjects(self, doc, arrays):
+        if arrays.table is not self.table:
+            return [doc.getObject(name) for name in arrays.names]
+        names = self.table.names
+        objs = []
+        for i in arrays.objects.tolist():
+            if i not in self.objects:
+                self.objects[i] = doc.getObject(names[i])
+            objs.append(self.objects[i])
+        return objs
+
+    def forgetObject(self, name):
+        self.objects.pop(self.table.index.get(name), None)
+
+    def add(self, step):
+        self.remove(step)
+        size = step._arrays.nbytes()
+        self.steps[step.name] = (step, size)
+        self.total += size
+        self.evict(step)
+
+    def use(self, step):
+        if step.name in self.steps:
+            self.steps.move_to_end(step.name)
+
+    def remove(self, step):
+        _, size = self.steps.pop(step.name, (None, 0))
+        self.total -= size
+
+    def evict(self, keep=None):
+        for name in list(self.steps):
+            if self.total <= self.budget:
+                break
+            step, size = self.steps[name]
+            if step is keep:
+                continue
+            del self.steps[name]
+            self.total -= size
+            step._arrays = None
+
+    def stats(self):
+        return {
+            'steps': len(self.steps),
+            'bytes': self.total,
+            'budget': self.budget,
+            'objects': len(self.objects),
+        }
+
+
+class Player:
+
+    def __init__(self, animation, baked):
+        from PySide import QtCore
+        self.animation = animation
+        self.baked = baked
+        self.doc = animation.obj.Document.Name
+        self.fps = animation.obj.getPropertyByName('FPS')
+        objs = [Doc().getObject(name) for name in baked.names]
+        backend = animation.obj.getPropertyByName('Backend')
+        self.backend = BACKENDS[backend](objs, getActiveView())
+        self.starts = [first for first, _, _ in baked.segments]
+        self.current = -1
+        self.shown = 0
+        self.dropped = 0
+        self.segment = -1
+        self.timer = QtCore.QTimer()
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.setInterval(max(int(1000 / self.fps), 1))
+        self.timer.timeout.connect(self.tick)
+
+    def start(self):
+        self.begin = time.perf_counter()
+        self.timer.start()
+        self.tick()
+
+    def isAlive(self):
+        return self.doc in App.listDocuments()
+
+    def stop(self, alive=True):
+        if not self.timer.isActive():
+            return
+        self.timer.stop()
+        # The scene graph overrides go away with a closed document
+        if alive and self.isAlive():
+            self.backend.close()
+        dt = time.perf_counter() - self.begin
+        self.animation.onPlayed({
+            'frames': self.shown,
+            'dropped': self.dropped,
+            'seconds': dt,
+            'fps': self.shown / dt if dt else 0,
+            'target': self.fps,
+        })
+
+    def tick(self):
+        try:
+            self.show()
+        except Exception as e:
+            # Otherwise the timer raises the same error at every tick
+            self.stop()
+            err(f'Playback stopped: {e}')
+
+    def show(self):
+        # The frame is picked by the wall clock, late ticks drop frames
+        if not STATE['play']:
+            return self.stop()
+        last = len(self.baked) - 1
+        if last < 0:
+            return self.stop()
+        i = min(int((time.perf_counter() - self.begin) * self.fps), last)
+        if i == self.current:
+            return
+        segment = bisect.bisect_right(self.starts, i) - 1
+        if segment != self.segment:
+            self.segment = segment
+            STATE['step'] = segment + 1
+            group = self.animation.getGroup()
+            group[segment].ViewObject.signalChangeIcon()
+            group[segment + 1].ViewObject.signalChangeIcon()
+        # Objects driven by skipped frames are settled on this one
+        self.dropped += max(i - self.current - 1, 0)
+        stats = self.animation.stats
+        with stats.phase('frame'):
+            with stats.phase('interpolate'):
+                frame = self.baked.frame(i, since=self.current)
+            with stats.phase('apply'):
+                self.backend.apply(frame)
+        self.current = i
+        self.shown += 1
+        if i == last:
+            self.stop()
 
 
 class Animation:
@@ -245,13 +873,49 @@ class Animation:
         if not obj:
             obj = Doc().addObject('App::DocumentObjectGroupPython', 'Animation')
         self.obj = obj
+        self.baked = None
+        self.player = None
+        # The pool is saved with the proxy, a new proxy takes it over
+        previous = getattr(obj, 'Proxy', None)
+        self.pool = getattr(previous, 'pool', None)
+        self.saved = getattr(previous, 'saved', None)
+        self.order = None
+        self.store = StepStore()
+        if self.pool is not None:
+            self.store.setTable(self.pool.table)
+        # Phase timings of the last play or render
+        self.stats = profiler.Profiler()
+        # Objects changed since the baseline step was applied or captured
+        self.dirty = set()
+        self.baseline = None
+        self.tracking = True
+        obj.Proxy = self
+        if obj.ViewObject:
+            obj.ViewObject.Proxy = self
         self.steps = {}
         for step in obj.Group:
             self.steps[step.Name] = Step(step, obj)
+        keys = [o.getPropertyByName('SortKey')
+                if 'SortKey' in o.PropertiesList else None
+                for o in obj.Group]
+        if not all(isinstance(k, str) for k in keys):
+            # Older animations are ordered by the group itself, or by the
+            # float keys of the previous version
+            order = [o for _, o in sorted(
+                enumerate(obj.Group), key=lambda p: (
+                    keys[p[0]] if isinstance(keys[p[0]], float) else 0.0,
+                    p[0]))]
+            key = ''
+            for step in order:
+                key = engine.keyBetween(key)
+                if 'SortKey' in step.PropertiesList:
+                    step.removeProperty('SortKey')
+                newProp(step, 'SortKey', 'String', key, 'Animation',
+                        'Position of the step in the animation')
+            if obj.Group != order:
+                obj.Group = order
         if not obj.Group:
             self.addStep()
-        obj.Proxy = self
-        obj.ViewObject.Proxy = self
         # Properties
         newProp(obj, 'OutputFilename', 'File', 'video.mp4', 'Video')
         newProp(obj, 'FFmpeg', 'File', '', 'Video')
@@ -262,9 +926,35 @@ class Animation:
             'Current', 'Black', 'White', 'Transparent'
         ], 'Video')
         newProp(obj, 'FPS', 'Integer', 24, 'Video')
+        newEnum(obj, 'Capture', CAPTURES, 'Video',
+                'Framebuffer streams raw frames from the 3D view, '
+                'Offscreen renders them without repainting the GUI')
+        newProp(obj, 'Camera', 'String', '', 'Video',
+                'Camera for offscreen renders without a 3D view')
+        newProp(obj, 'Workers', 'Integer', 1, 'Video',
+                'Worker processes rendering frame ranges in parallel')
+        newProp(obj, 'ChunkFrames', 'Integer', 0, 'Video',
+                'Frames rendered by each worker job, 0 splits by step')
+        newProp(obj, 'ReusePalette', 'Bool', False, 'Video',
+                'Reuse the palette of the last GIF export of this document')
+        newProp(obj, 'FrameCacheSize', 'Integer', 0, 'Video',
+                'Size in MB of the rendered frame cache, 0 disables it')
+        newProp(obj, 'TraceFile', 'File', '', 'Video',
+                'Chrome trace of the phases of every rendered frame')
+        newProp(obj, 'MemoryBudget', 'Integer', 256, 'Animation',
+                'Memory in MB for hydrated steps, cold ones are evicted')
+        self.onChanged(obj, 'MemoryBudget')
+        newProp(obj, 'SegmentCache', 'Bool', False, 'Video',
+                'Keep every step segment encoded, only the ones that '
+                'changed are rendered again')
+        newEnum(obj, 'Backend', list(BACKENDS), 'Video',
+                'Coin moves the scene graph for play and render, without '
+                'changing the document')
 
     def onChanged(self, fp, prop):
-        pass
+        if prop == 'MemoryBudget' and hasattr(self, 'store'):
+            self.store.budget = fp.MemoryBudget * 1024 * 1024
+            self.store.evict()
 
     def execute(self, fp):
         pass
@@ -273,171 +963,754 @@ class Animation:
         return f'{ICONPATH}/animation.svg'
 
     def addStep(self, before=None):
-        if not before:
-            id = 'Step{:0>3d}'.format(len(self.obj.Group))
-            obj = Doc().addObject('App::DocumentObjectGroupPython', f'Step')
-            obj.Label = id
-            step = Step(obj, self.obj)
-            self.steps[obj.Name] = step
-            self.obj.addObject(obj)
-            STATE['step'] = len(self.obj.Group) - 1
-        else:
-            tmp = Doc().addObject('App::DocumentObjectGroupPython', 'TMPGroup')
-            for i in range(len(self.obj.Group) - before):
-                obj = self.obj.removeObject(self.obj.Group[before])[0]
-                obj.Label = f'_{obj.Label}'
-                tmp.addObject(obj)
-            self.addStep()
-            id0 = len(self.obj.Group)
-            for i in range(len(tmp.Group)):
-                obj = tmp.removeObject(tmp.Group[0])[0]
-                obj.Label = 'Step{:0>3d}'.format(id0 + i)
-                self.obj.addObject(obj)
-            Doc().removeObject(tmp.Name)
+        # Only the new step is touched, the others keep their sort keys
+        group = self.getGroup()
+        index = len(group) if before is None else before
+        key = self.getSortKey(group, index)
+        obj = Doc().addObject('App::DocumentObjectGroupPython', 'Step')
+        obj.Label = self.getLabel(group, index)
+        newProp(obj, 'SortKey', 'String', key, 'Animation',
+                'Position of the step in the animation')
+        step = Step(obj, self.obj)
+        self.steps[obj.Name] = step
+        self.obj.Group = group[:index] + [obj] + group[index:]
+        self.order = None
+        STATE['step'] = index
+        self.invalidate()
+        return step
+
+    def moveStep(self, step, index):
+        group = [o for o in self.getGroup() if o != step.obj]
+        step.obj.SortKey = self.getSortKey(group, index)
+        self.obj.Group = group[:index] + [step.obj] + group[index:]
+
+    def getSortKey(self, group, index):
+        # Key between the steps around index of the sorted group
+        lo = group[index - 1].SortKey if index > 0 else ''
+        hi = group[index].SortKey if index < len(group) else None
+        return engine.keyBetween(lo, hi)
+
+    def getLabel(self, group, index):
+        # Appended steps are numbered, inserted ones are named after the
+        # step before them, so no other label changes
+        if index == len(group):
+            return 'Step{:0>3d}'.format(index)
+        if index == 0:
+            return f'{group[0].Label}.0'
+        return f'{group[index - 1].Label}.1'
+
+    def getGroup(self):
+        # Step objects sorted by their key, the tree shows the same order
+        if self.order is None:
+            group = self.obj.Group
+            self.order = sorted(group, key=lambda o: (
+                o.getPropertyByName('SortKey')
+                if 'SortKey' in o.PropertiesList else ''))
+        return self.order
 
     def getTotalFrames(self):
-        tf = 0
-        fps = self.obj.getPropertyByName('FPS')
-        for obj in self.obj.Group[:-1]:
-            step = self.steps[obj.Name]
-            tf += step.ds * fps
-        return int(tf)
+        return len(self.getTimeline())
+
+    def getTimeline(self, fps=None):
+        fps = fps or self.obj.getPropertyByName('FPS')
+        durations = tuple(s.ds for s in self.getSteps()[:-1])
+        timeline = getattr(self, 'timeline', None)
+        if timeline is None or timeline.fps != fps or \
+                tuple(timeline.durations) != durations:
+            self.timeline = engine.Timeline(durations, fps)
+        return self.timeline
+
+    def evaluate(self, t):
+        # Interpolated state at t seconds, every object is driven
+        steps = self.getSteps()
+        if len(steps) < 2:
+            return None
+        i, delta = self.getTimeline().locate(t)
+        frame = steps[i + 1].segment(steps[i]).frame(delta)
+        frame.driven = numpy.ones(len(frame.names), dtype=bool)
+        return frame, int(i)
+
+    def seek(self, t):
+        result = self.evaluate(t)
+        if result is None:
+            return
+        frame, i = result
+        objs = [Doc().getObject(name) for name in frame.names]
+        with self.untracked(), frameTransaction(getActiveView()) as written:
+            written += applyFrame(objs, frame)
+        self.setBaseline(None)
+        STATE['step'] = i + 1
+
+    def getSteps(self):
+        group = self.getGroup()
+        return [self.steps[o.Name] for o in group if o.Name in self.steps]
+
+    def touch(self, obj):
+        if self.tracking and not STATE['play'] and isTracked(obj):
+            self.dirty.add(obj.Name)
+
+    @contextlib.contextmanager
+    def untracked(self):
+        tracking = self.tracking
+        self.tracking = False
+        try:
+            yield
+        finally:
+            self.tracking = tracking
+
+    def setBaseline(self, step=None):
+        # The document now matches step, besides objects it doesn't know
+        if step is None:
+            self.baseline = None
+            self.dirty.clear()
+            return
+        prev = self.steps.get(self.baseline)
+        if prev is not None:
+            self.dirty.update(prev.getNames())
+        else:
+            objs = Doc().findObjects()
+            self.dirty = {obj.Name for obj in objs if isTracked(obj)}
+        self.dirty.difference_update(step.getNames())
+        self.baseline = step.name
+
+    def getMemory(self):
+        # Footprint in bytes, the bake is memory mapped from disk
+        return {
+            'steps': self.store.stats(),
+            'pool': self.pool.nbytes() if self.pool else 0,
+            'bake': self.baked.data.nbytes if self.baked is not None else 0,
+        }
+
+    def getChanges(self, step):
+        # Rows of step that differ from the document, as far as it's known
+        arrays = step.arrays
+        base = self.steps.get(self.baseline)
+        if base is None:
+            return numpy.arange(len(arrays))
+        changed = engine.changedRows(base.arrays, arrays)
+        index = arrays.table.index
+        dirty = [index[name] for name in self.dirty if name in index]
+        changed |= numpy.isin(arrays.objects, dirty)
+        return numpy.flatnonzero(changed)
+
+    def capture(self, step):
+        base = self.steps.get(self.baseline)
+        if base is not None:
+            arrays = captureState(base.arrays, list(self.dirty))
+        else:
+            arrays = captureState()
+        # Stored as a diff against the previous step
+        pool = self.getPool()
+        prev = self.getPrevious(step)
+        snapshot = pool.snapshot(arrays, prev.getSnapshot() if prev else -1)
+        return engine.encodePooled(snapshot), pool.get(snapshot)
+
+    def getPrevious(self, step):
+        # Step before step, which may not be in the group yet
+        key = step.obj.getPropertyByName('SortKey')
+        steps = [s for s in self.getSteps()
+                 if s is not step and s.obj.SortKey < key]
+        return steps[-1] if steps else None
+
+    def getPool(self):
+        if self.pool is None:
+            self.pool = engine.StatePool.decode(self.saved)
+            self.store.setTable(self.pool.table)
+        return self.pool
+
+    def getBakePath(self):
+        filename = self.obj.Document.FileName
+        if not filename:
+            return None
+        return f'{os.path.splitext(filename)[0]}.i10g'
+
+    def getCachePath(self):
+        try:
+            root = App.getUserCachePath()
+        except AttributeError:
+            root = tempfile.gettempdir()
+        return os.path.join(root, 'i10g')
+
+    def getFrameCache(self, settings):
+        # Frames are content addressed, so every document shares one cache
+        if settings['cache'] <= 0 or settings['capture'] == 'SaveImage':
+            return None
+        return cache.FrameCache(self.getCachePath(), settings['cache'])
+
+    def getFrameSalt(self, settings):
+        # Everything besides the scene state that changes the pixels
+        keys = ('resolution', 'background', 'capture', 'camera')
+        text = '\0'.join([getattr(self.obj.Document, 'Uid', ''),
+                          self.getGeometryDigest()] +
+                         [str(settings[k]) for k in keys])
+        return text.encode()
+
+    def getGeometryDigest(self):
+        # Model edits outside the steps (a sketch, a Pad) change the frames
+        h = hashlib.sha1()
+        for obj in self.obj.Document.Objects:
+            shape = getattr(obj, 'Shape', None)
+            if obj.TypeId in TRACKED or shape is None or shape.isNull():
+                continue
+            box = shape.BoundBox
+            values = [obj.Name, box.XMin, box.YMin, box.ZMin, box.XMax,
+                      box.YMax, box.ZMax]
+            try:
+                values += [shape.Area, shape.Volume]
+            except Exception:
+                pass
+            h.update(repr(values).encode())
+        return h.hexdigest()
+
+    def getPalettePath(self, settings):
+        # Only kept (in the user cache) when it is going to be reused
+        if not settings['reusePalette']:
+            return None
+        path = os.path.join(self.getCachePath(), 'palettes')
+        os.makedirs(path, exist_ok=True)
+        doc = self.obj.Document
+        return os.path.join(path, f'{getattr(doc, "Uid", "") or doc.Name}.png')
+
+    def invalidate(self, step=None):
+        if getattr(self, 'baked', None) is None:
+            return
+        if step is None:
+            self.baked.invalidate()
+        elif step.obj in self.getGroup():
+            i = self.getGroup().index(step.obj)
+            self.baked.invalidate([j for j in (i - 1, i, i + 1) if j >= 0])
+
+    def bake(self, fps=None):
+        path = self.getBakePath()
+        if self.baked is None or self.baked.path != path:
+            self.baked = bake.Bake(path)
+        timeline = self.getTimeline(fps)
+        steps = self.getSteps()
+        names = list(dict.fromkeys(n for s in steps for n in s.getNames()))
+        plan = []
+        settled = 0
+        for i in range(1, len(steps)):
+            prev, step = steps[i - 1], steps[i]
+            deltas = timeline.segment(i - 1)
+            # The first frame also settles what moved since the last frame
+            digests = [s.digest() for s in steps[settled:i + 1]]
+            if len(deltas):
+                settled = i - 1
+            signature = hashlib.sha1(
+                ''.join(digests).encode() + deltas.tobytes()
+            ).hexdigest()
+            plan.append((signature, deltas,
+                         lambda p=prev, s=step: s.segment(p)))
+        if self.baked.update(names, plan):
+            log(f'baked {len(self.baked)} frames')
+        return self.baked
 
     def play(self):
-        prev = None
         Gui.Selection.clearSelection()
         Gui.runCommand('Std_DrawStyle', 5)
         STATE['play'] = True
-        guifps = STATE['GUIFPS']
-        framecount = 0
-        start = time.time()
-        count = len(self.obj.Group)
-        for i, obj in enumerate(self.obj.Group):
-            STATE['step'] = i
-            step = self.steps[obj.Name]
-            if prev is None:
-                prev = step
-                continue
-            prev.obj.ViewObject.signalChangeIcon()
-            step.obj.ViewObject.signalChangeIcon()
-            for delta in getDeltas(guifps, i == count - 1):
-                step.anim(prev, delta)
-                framecount += 1
-                Gui.updateGui()
-                time.sleep(0.01)
-                if not STATE['play']:
-                    break
-            guifps = numpy.max((framecount / (time.time() - start), 3))
-            prev = step
-            if not STATE['play']:
-                break
-        STATE['GUIFPS'] = guifps
-        print(f'{int(guifps)} fps')
+        MATERIALS.forget()
+        self.setBaseline(None)
+        self.stats.clear()
+        self.player = Player(self, self.bake())
+        self.player.start()
+
+    def pause(self):
+        STATE['play'] = False
+        player = getattr(self, 'player', None)
+        if player:
+            player.stop()
+
+    def onPlayed(self, stats):
+        self.player = None
+        STATE['GUIFPS'] = stats['fps']
+        print('{fps:.0f}/{target} fps, {dropped} frames dropped'.format(
+            **stats))
+        log(f'materials: {MATERIALS.stats()}')
+        log(f'memory: {self.getMemory()}')
+        log(self.stats.report())
         STATE['play'] = False
         Gui.runCommand('Std_DrawStyle', 6)
-        Doc().recompute(None, True, True)
-
-    def video(self):
-        name = self.obj.getPropertyByName('OutputFilename')
-        r = self.obj.getPropertyByName('CustomResolution')
-        if not r:
-            r = self.obj.getPropertyByName('Resolution')
-        w, h = (int(c) for c in r.split('x'))
-        bg = self.obj.getPropertyByName('Background')
-        fps = self.obj.getPropertyByName('FPS')
-        ffmpeg = self.obj.getPropertyByName('FFmpeg')
-        if not ffmpeg:
+
+    def getRenderSettings(self, **overrides):
+        settings = {
+            'output': self.obj.getPropertyByName('OutputFilename'),
+            'resolution': self.obj.getPropertyByName('CustomResolution') or
+            self.obj.getPropertyByName('Resolution'),
+            'background': self.obj.getPropertyByName('Background'),
+            'fps': self.obj.getPropertyByName('FPS'),
+            'ffmpeg': self.obj.getPropertyByName('FFmpeg'),
+            'capture': self.obj.getPropertyByName('Capture'),
+            'camera': self.obj.getPropertyByName('Camera'),
+            'workers': self.obj.getPropertyByName('Workers'),
+            'chunk': self.obj.getPropertyByName('ChunkFrames'),
+            'reusePalette': self.obj.getPropertyByName('ReusePalette'),
+            'cache': self.obj.getPropertyByName('FrameCacheSize'),
+            'trace': self.obj.getPropertyByName('TraceFile'),
+            'backend': self.obj.getPropertyByName('Backend'),
+            'segments': self.obj.getPropertyByName('SegmentCache'),
+        }
+        settings.update({k: v for k, v in overrides.items() if v is not None})
+        return settings
+
+    def render(self, progress=None, cancelled=None, onSegment=None,
+               frames=None, **overrides):
+        # Renders the timeline (or frames [start, stop) of it), without
+        # touching the workbench UI
+        settings = self.getRenderSettings(**overrides)
+        if not settings['ffmpeg']:
             err(f'FFmpeg path not set!')
-            return
-        vr = VideoRenderer(ffmpeg)
-        vr.begin(name, w, h, bg, fps)
-        prev = None
+            return None
+        w, h = (int(c) for c in settings['resolution'].split('x'))
+        capture = settings['capture']
+        start = time.time()
+        self.stats.clear()
+        with self.stats.phase('bake'):
+            baked = self.bake(settings['fps'])
+        dt = time.time() - start
+        gif = os.path.splitext(settings['output'])[1].lower() == '.gif'
+        # GIF parts can't be joined losslessly, they each have a palette
+        parts = settings['workers'] > 1 or settings['segments']
+        if frames is None and parts and not gif:
+            stats = self.renderParts(baked, settings, progress, cancelled)
+            stats['bake'] = dt
+            return stats
+        first, last = frames or (0, len(baked))
+        starts = {s[0]: i for i, s in enumerate(baked.segments)}
+        objs = [self.obj.Document.getObject(name) for name in baked.names]
+        vr = VideoRenderer(settings['ffmpeg'], capture, settings['camera'],
+                           progress, self.getPalettePath(settings),
+                           settings['reusePalette'], self.stats)
+        vr.begin(settings['output'], w, h, settings['background'],
+                 settings['fps'])
+        MATERIALS.forget()
+        self.setBaseline(None)
+        frames = self.getFrameCache(settings)
+        salt = self.getFrameSalt(settings)
+        size = vr.getFrameSize()
+        settled = False
+        tf = last - first
+        phase = self.stats.phase
+        backend = BACKENDS[settings['backend']](objs, getActiveView())
+        pump = time.time()
+        try:
+            with self.untracked(), contextlib.closing(backend):
+                for row in range(first, last):
+                    if onSegment and row in starts:
+                        onSegment(starts[row])
+                    with phase('frame'):
+                        with phase('cache'):
+                            key = frames and baked.digest(row, salt)
+                            data = frames and frames.get(key, size)
+                        if data is not None:
+                            vr.addFrame(tf, data)
+                            settled = False
+                        else:
+                            # Ranges may start mid-segment and cached
+                            # frames are never applied, so everything is
+                            # settled first
+                            with phase('interpolate'):
+                                frame = baked.frame(row, full=not settled)
+                            with phase('apply'):
+                                backend.apply(frame)
+                            settled = True
+                            if capture != 'Offscreen':
+                                with phase('updateGui'):
+                                    Gui.updateGui()
+                                pump = time.time()
+                            data = vr.addFrame(tf)
+                            if frames and data is not None:
+                                with phase('cache'):
+                                    frames.put(key, data)
+                    # Offscreen renders don't repaint, but still notice
+                    # aborts
+                    if time.time() - pump > 0.1 and Gui.getMainWindow():
+                        with phase('updateGui'):
+                            Gui.updateGui()
+                        pump = time.time()
+                    if cancelled and cancelled():
+                        break
+        except OSError as e:
+            # FFmpeg stopped reading frames, its return code is reported
+            if e is not vr.error:
+                raise
+            err(f'Encoding failed: {e}')
+        finally:
+            stats = vr.end()
+        stats['bake'] = dt
+        if frames:
+            stats['cache'] = frames.stats()
+            log(f'frame cache: {stats["cache"]}')
+        stats['output'] = settings['output']
+        stats['profile'] = self.stats.summary()
+        stats['memory'] = self.getMemory()
+        log(f'memory: {stats["memory"]}')
+        log(f'materials: {MATERIALS.stats()}')
+        log(self.stats.report())
+        if settings['trace']:
+            self.stats.trace(settings['trace'])
+        return stats
+
+    def getChunks(self, baked, size=0):
+        if size > 0:
+            return [(i, min(i + size, len(baked)))
+                    for i in range(0, len(baked), size)]
+        return [(first, first + frames)
+                for first, frames, _ in baked.segments if frames]
+
+    def getChunkDir(self):
+        filename = self.obj.Document.FileName
+        if not filename:
+            return None
+        path = f'{os.path.splitext(filename)[0]}.chunks'
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def renderParts(self, baked, settings, progress=None, cancelled=None):
+        # Frame ranges are rendered to separate files, by worker processes
+        # or in this one, then joined without re-encoding. PNG frames are
+        # all keyframes, so the result is the same as a serial render
+        start = time.time()
+        if settings['workers'] > 1:
+            # Workers render offscreen, parts rendered here must match them
+            settings = dict(settings, capture='Offscreen')
+        output = settings['output']
+        ext = os.path.splitext(output)[1] or '.mp4'
+        chunkdir = self.getChunkDir() if settings['segments'] else None
+        tmpdir = tempfile.mkdtemp(prefix='i10g')
+        try:
+            if chunkdir:
+                # Step segments are kept, keyed by everything they depend on
+                chunks = self.getChunks(baked)
+                salt = self.getFrameSalt(settings) + '{fps}{backend}'.format(
+                    **settings).encode() + ext.encode()
+                parts = [os.path.join(chunkdir, hashlib.sha1(
+                    salt + signature.encode()).hexdigest() + ext)
+                    for _, frames, signature in baked.segments if frames]
+                for name in os.listdir(chunkdir):
+                    if os.path.join(chunkdir, name) not in parts:
+                        os.remove(os.path.join(chunkdir, name))
+            else:
+                chunks = self.getChunks(baked, settings['chunk'])
+                parts = [None] * len(chunks)
+            targets = [os.path.join(tmpdir, f'part{i:04d}{ext}')
+                       for i in range(len(chunks))]
+            parts = [part or target for part, target in zip(parts, targets)]
+            todo = [i for i, part in enumerate(parts)
+                    if not os.path.exists(part)]
+            done = [0] * len(chunks)
+            workers = min(settings['workers'], len(todo)) or 1
+            if workers > 1:
+                returncode = self.runWorkers(settings, chunks, targets, todo,
+                                             done, tmpdir, progress,
+                                             cancelled)
+            else:
+                returncode = 0
+                total = sum(chunks[i][1] - chunks[i][0] for i in todo)
+                for i in todo:
+                    offset = sum(done)
+
+                    def report(count, _, dt, i=i, offset=offset):
+                        done[i] = count
+                        (progress or printProgress)(offset + count, total,
+                                                    time.time() - start)
+
+                    stats = self.render(
+                        report, cancelled, frames=chunks[i],
+                        **dict(settings, output=targets[i]))
+                    returncode = stats['returncode']
+                    if returncode or (cancelled and cancelled()):
+                        returncode = returncode or 1
+                        break
+            if returncode == 0:
+                for i in todo:
+                    if parts[i] != targets[i]:
+                        shutil.move(targets[i], parts[i])
+                listfile = os.path.join(tmpdir, 'parts.txt')
+                with open(listfile, 'w') as fp:
+                    fp.writelines(f"file '{part}'\n" for part in parts)
+                returncode = subprocess.call([
+                    settings['ffmpeg'], '-y', '-f', 'concat', '-safe', '0',
+                    '-i', listfile, '-c', 'copy', output])
+        finally:
+            shutil.rmtree(tmpdir)
+        dt = time.time() - start
+        reused = len(chunks) - len(todo)
+        if not progress:
+            fmt = '{:0>2.0f}:{:0>2.0f}'.format(dt//60, dt%60)
+            print(f'Exported {sum(done)} frames in {fmt} ({len(chunks)} '
+                  f'parts, {reused} reused, {workers} workers)')
+        return {
+            'frames': sum(done),
+            'seconds': dt,
+            'fps': sum(done) / dt if dt else 0,
+            'returncode': returncode,
+            'output': output,
+            'parts': len(chunks),
+            'reused': reused,
+            'workers': workers,
+        }
+
+    def runWorkers(self, settings, chunks, targets, todo, done, tmpdir,
+                   progress=None, cancelled=None):
+        # Each worker process renders from a copy of the document
+        start = time.time()
+        doc = os.path.join(tmpdir, 'document.FCStd')
+        self.obj.Document.saveCopy(doc)
+        # Workers load the bake instead of computing it again, all at once
+        # into the same file otherwise
+        self.baked.copy(f'{doc[:-6]}.i10g')
+        command, env = getWorkerCommand()
+        command += [
+            doc, '--workers', '1', '--progress', '1',
+            '-r', settings['resolution'],
+            '--fps', str(settings['fps']),
+            '-b', settings['background'],
+            '--ffmpeg', settings['ffmpeg'],
+            '--capture', settings['capture'],
+        ]
+        procs = []
+        stop = threading.Event()
+
+        def work(i):
+            if stop.is_set():
+                return None
+            a, b = chunks[i]
+            p = subprocess.Popen(
+                command + ['-o', targets[i], '--frames', f'{a}:{b}'],
+                stdout=subprocess.PIPE, env=env, text=True)
+            procs.append(p)
+            for line in p.stdout:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get('event') == 'progress':
+                    done[i] = event['frame']
+                elif event.get('event') == 'error':
+                    warn(f'frames {a}-{b}: {event.get("message")}')
+            return p.wait()
+
+        total = sum(chunks[i][1] - chunks[i][0] for i in todo)
+        count = 0
+        workers = min(settings['workers'], len(todo))
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            futures = [pool.submit(work, i) for i in todo]
+            while not all(f.done() for f in futures):
+                time.sleep(0.1)
+                if cancelled and cancelled() and not stop.is_set():
+                    stop.set()
+                    for p in procs:
+                        p.terminate()
+                if sum(done) != count:
+                    count = sum(done)
+                    (progress or printProgress)(count, total,
+                                                time.time() - start)
+                elif Gui.getMainWindow():
+                    Gui.updateGui()
+        codes = [f.result() for f in futures]
+        if stop.is_set():
+            return 1
+        return max([abs(c) for c in codes if c is not None] or [0])
+
+    def video(self, **overrides):
+        view = getActiveView()
+        if view and view.getCamera() != self.obj.Camera:
+            self.obj.Camera = view.getCamera()
+
+        def onSegment(i):
+            STATE['step'] = i + 1
+            self.getGroup()[i].ViewObject.signalChangeIcon()
+            self.getGroup()[i + 1].ViewObject.signalChangeIcon()
+
         STATE['render'] = True
         STATE['play'] = True
         Gui.Selection.clearSelection()
         Gui.runCommand('Std_DrawStyle', 5)
-        tf = self.getTotalFrames()
-        count = len(self.obj.Group)
-        for i, obj in enumerate(self.obj.Group):
-            STATE['step'] = i
-            step = self.steps[obj.Name]
-            if prev is None:
-                prev = step
-                continue
-            prev.obj.ViewObject.signalChangeIcon()
-            step.obj.ViewObject.signalChangeIcon()
-            frames = prev.ds * fps
-            for delta in getDeltas(frames, i == count - 1):
-                step.anim(prev, delta)
-                Gui.updateGui()
-                vr.addFrame(tf)
-                if not STATE['play']:
-                    break
-            prev = step
-            if not STATE['play']:
-                break
-        Gui.runCommand('Std_DrawStyle', 6)
-        vr.end()
-        STATE['play'] = False
-        STATE['render'] = False
-        Doc().recompute(None, True, True)
+        try:
+            self.render(cancelled=lambda: not STATE['play'],
+                        onSegment=onSegment, **overrides)
+        finally:
+            Gui.runCommand('Std_DrawStyle', 6)
+            STATE['play'] = False
+            STATE['render'] = False
 
     def __getstate__(self):
-        return None
-
-    def __setstate__(self,state):
+        # The state pool is saved with the proxy, so every save has it.
+        # Proxies restored but never used keep what they loaded
+        pool = getattr(self, 'pool', None)
+        if pool is None:
+            return getattr(self, 'saved', None)
+        steps = getattr(self, 'steps', {}).values()
+        return pool.encode([s.getSnapshot() for s in steps])
+
+    def __setstate__(self, state):
+        self.saved = state
         return None
 
 
 class Step:
     def __init__(self, obj, animation):
         obj.Proxy = self
-        obj.ViewObject.Proxy = self
+        if obj.ViewObject:
+            obj.ViewObject.Proxy = self
         self.obj = obj
         self.name = self.obj.Name
-        self.updateState()
         self.animation = animation
+        self._arrays = None
+        self._digest = None
+        # Only new steps capture the scene, the others hydrate on demand
+        newProp(self.obj, 'DurationInSeconds', 'Integer', 1, 'Animation')
+        self.ds = self.obj.getPropertyByName('DurationInSeconds')
+        if 'DocState' not in self.obj.PropertiesList:
+            self.updateState()
         STATE['#step'] = len(animation.Group)
-        obj.ViewObject.signalChangeIcon()
+        if obj.ViewObject:
+            obj.ViewObject.signalChangeIcon()
 
     def onChanged(self, fp, prop):
-        if prop == 'DurationInSeconds':
+        if prop == 'DocState':
+            # e.g. undone, hydrated again when needed
+            self._arrays = None
+            self._digest = None
+            animation = self.getAnimation()
+            if animation:
+                animation.store.remove(self)
+                animation.invalidate(self)
+        elif prop == 'DurationInSeconds':
             self.ds = self.obj.getPropertyByName('DurationInSeconds')
+            self.invalidate()
+        elif prop == 'SortKey':
+            animation = self.getAnimation()
+            if animation:
+                animation.order = None
+                animation.invalidate()
 
     def execute(self, fp):
         pass
 
     def getIcon(self):
-        if STATE['step'] == self.animation.Group.index(self.obj):
+        animation = self.getAnimation()
+        group = animation.getGroup() if animation else self.animation.Group
+        if self.obj in group and STATE['step'] == group.index(self.obj):
             return f'{ICONPATH}/selected_step.svg'
         return f'{ICONPATH}/step.svg'
 
+    def getAnimation(self):
+        animation = getattr(self, 'animation', None)
+        if animation and isinstance(animation.Proxy, Animation):
+            return animation.Proxy
+        return None
+
     def updateState(self, force=False):
-        if force:
-            self.obj.removeProperty('DocState')
         # Properties
         newProp(self.obj, 'DurationInSeconds', 'Integer', 1, 'Animation')
-        newProp(self.obj, 'DocState', 'PythonObject', getState())
-        self.state = copy.deepcopy(self.obj.getPropertyByName('DocState'))
         self.ds = self.obj.getPropertyByName('DurationInSeconds')
-        # Parse values
-        for value in self.state.values():
-            value['pos'] = App.Placement(App.Matrix(*value['pos']))
-            if value['material']:
-                value['material'] = newMaterial(
-                    value['color'],
-                    value['transparency']
-                )
-            value['obj'] = Doc().getObject(value['name'])
+        if not force and 'DocState' in self.obj.PropertiesList:
+            return
+        animation = self.getAnimation()
+        if animation:
+            state, arrays = animation.capture(self)
+        else:
+            arrays = captureState()
+            state = engine.encodeState(arrays)
+        if force:
+            self.obj.removeProperty('DocState')
+        newProp(self.obj, 'DocState', 'PythonObject', state)
+        self._arrays = arrays
+        self._digest = None
+        if animation:
+            animation.store.add(self)
+            animation.dirty.clear()
+            animation.baseline = self.name
+        self.invalidate()
+
+    def getSnapshot(self):
+        state = self.obj.getPropertyByName('DocState')
+        if state.get('version') != engine.POOLED:
+            return -1
+        return state['snapshot']
+
+    def hydrate(self):
+        # Parse values, legacy dict states are still readable
+        state = self.obj.getPropertyByName('DocState')
+        animation = self.getAnimation()
+        self._arrays = engine.decodeState(state,
+                                          animation and animation.getPool())
+        if animation:
+            animation.store.add(self)
+
+    @property
+    def arrays(self):
+        if self._arrays is None:
+            self.hydrate()
+        else:
+            self.touchStore()
+        return self._arrays
+
+    @property
+    def objs(self):
+        # Resolved on use, deleted objects are never written
+        arrays = self.arrays
+        animation = self.getAnimation()
+        if animation:
+            return animation.store.getObjects(Doc(), arrays)
+        return [Doc().getObject(name) for name in arrays.names]
+
+    def touchStore(self):
+        animation = self.getAnimation()
+        if animation:
+            animation.store.use(self)
+
+    def getNames(self):
+        if self._arrays is not None:
+            return self._arrays.names
+        state = self.obj.getPropertyByName('DocState')
+        animation = self.getAnimation()
+        return engine.stateNames(state, animation and animation.getPool())
+
+    def digest(self):
+        if self._digest is None:
+            state = self.obj.getPropertyByName('DocState')
+            animation = self.getAnimation()
+            self._digest = engine.stateDigest(
+                state, animation and animation.getPool())
+        return self._digest
+
+    def invalidate(self):
+        animation = self.getAnimation()
+        if animation:
+            animation.invalidate(self)
 
     def apply(self):
-        for objState in self.state.values():
-            applyObjState(objState)
-        Doc().recompute(None, True, True)
+        MATERIALS.forget()
+        animation = self.getAnimation()
+        if not animation:
+            applyState(self.objs, self.arrays)
+            Doc().recompute(None, True, True)
+            return
+        # Only objects that differ from what is shown are written
+        idx = animation.getChanges(self)
+        objs = self.objs
+        objs = [objs[i] for i in idx]
+        with animation.untracked():
+            applyState(objs, self.arrays.take(idx))
+        animation.setBaseline(self)
+        objs = [obj for obj in objs if obj]
+        if objs:
+            Doc().recompute(objs, True, True)
+
+    def segment(self, prev):
+        return engine.Segment(prev.arrays, self.arrays)
 
     def anim(self, prev, delta):
-        for name, objState in self.state.items():
-            animObjState(objState['obj'], prev.state[name], objState, delta)
+        animation = self.getAnimation()
+        stats = animation.stats if animation else profiler.Profiler()
+        with stats.phase('interpolate'):
+            frame = self.segment(prev).frame(delta)
+        with stats.phase('apply'), frameTransaction(getActiveView()) \
+                as written:
+            written += applyFrame(self.objs, frame)
 
     def __getstate__(self):
         return None
@@ -460,9 +1733,48 @@ class DocumentObserver():
 
     def slotDeletedDocument(self, doc):
         if STATE['doc'] == doc:
+            a = STATE['animation']
+            if a and a.player:
+                a.player.stop(alive=False)
             STATE['doc'] = None
             STATE['animation'] = None
 
+    def slotCreatedObject(self, obj):
+        a = STATE['animation']
+        if a and obj.Document == a.obj.Document:
+            a.store.forgetObject(obj.Name)
+            a.touch(obj)
+
+    def slotChangedObject(self, obj, prop):
+        a = STATE['animation']
+        if a and prop in ('Placement', 'Visibility') and \
+                obj.Document == a.obj.Document:
+            a.touch(obj)
+
+    def slotDeletedObject(self, obj):
+        a = STATE['animation']
+        if not a or obj.Document != a.obj.Document:
+            return
+        a.store.forgetObject(obj.Name)
+        if obj.Name in a.steps:
+            a.store.remove(a.steps[obj.Name])
+            del a.steps[obj.Name]
+            a.order = None
+            a.invalidate()
+        else:
+            a.touch(obj)
+
+
+class ViewObserver():
+    def __init__(self):
+        Gui.addDocumentObserver(self)
+
+    def slotChangedObject(self, vobj, prop):
+        a = STATE['animation']
+        if a and prop in ('OverrideMaterial', 'ShapeMaterial') and \
+                vobj.Object.Document == a.obj.Document:
+            a.touch(vobj.Object)
+
 
 class SelectionObserver:
     def __init__(self):
@@ -471,9 +1783,9 @@ class SelectionObserver:
     def addSelection(self, doc, obj, sub, pos):
         a = STATE['animation']
         if obj in a.steps:
-            oldSelectedObj = a.obj.Group[STATE['step']]
+            oldSelectedObj = a.getGroup()[STATE['step']]
             selectedObj = a.steps[obj].obj
-            STATE['step'] = a.obj.Group.index(selectedObj)
+            STATE['step'] = a.getGroup().index(selectedObj)
             oldSelectedObj.ViewObject.signalChangeIcon()
             selectedObj.ViewObject.signalChangeIcon()
             a.steps[obj].apply()
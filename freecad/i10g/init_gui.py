@@ -37,6 +37,7 @@ class Inbetweening(Gui.Workbench):
         import freecad.i10g.i10g as i10g
         i10g.STATE['selObs'] = i10g.SelectionObserver()
         i10g.STATE['docObs'] = i10g.DocumentObserver()
+        i10g.STATE['viewObs'] = i10g.ViewObserver()
 
     def Activated(self):
         pass
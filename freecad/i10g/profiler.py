@@ -0,0 +1,78 @@
+import os
+import json
+import time
+import numpy
+import contextlib
+import threading
+
+
+# Histogram bin edges, in milliseconds
+BINS = [0, 0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, numpy.inf]
+
+
+class Profiler:
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+
+    def clear(self):
+        self.origin = time.perf_counter()
+        self.events = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.events.append((name, start, time.perf_counter() - start,
+                                threading.get_ident()))
+
+    def durations(self):
+        phases = {}
+        for name, _, dt, _ in self.events:
+            phases.setdefault(name, []).append(dt)
+        return {name: numpy.array(dts) * 1000 for name, dts in phases.items()}
+
+    def summary(self):
+        # Per phase timings in milliseconds
+        summary = {}
+        for name, ms in self.durations().items():
+            summary[name] = {
+                'count': len(ms),
+                'total': float(ms.sum()),
+                'mean': float(ms.mean()),
+                'p50': float(numpy.percentile(ms, 50)),
+                'p95': float(numpy.percentile(ms, 95)),
+                'max': float(ms.max()),
+                'histogram': numpy.histogram(ms, BINS)[0].tolist(),
+            }
+        return summary
+
+    def report(self):
+        lines = []
+        for name, s in sorted(self.summary().items(),
+                              key=lambda item: -item[1]['total']):
+            lines.append('{:<12} {:>7} x {:8.2f} ms (p95 {:.2f}, '
+                         'max {:.2f}) = {:.1f} s'.format(
+                             name, s['count'], s['mean'], s['p95'],
+                             s['max'], s['total'] / 1000))
+        return '\n'.join(lines)
+
+    def trace(self, path):
+        # Chrome trace format, open it in chrome://tracing or Perfetto
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for name, start, dt, thread in self.events:
+            events.append({
+                'name': name,
+                'ph': 'X',
+                'ts': (start - self.origin) * 1e6,
+                'dur': dt * 1e6,
+                'pid': pid,
+                'tid': threads.setdefault(thread, len(threads)),
+            })
+        with open(path, 'w') as fp:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
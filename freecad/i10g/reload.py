@@ -15,6 +15,7 @@ class ReloadWorkbench():
         try:
             Gui.Selection.removeObserver(STATE['selObs'])
             App.removeDocumentObserver(STATE['docObs'])
+            Gui.removeDocumentObserver(STATE['viewObs'])
         except:
             pass
         try:
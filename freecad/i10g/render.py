@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+
+BACKGROUNDS = ['Current', 'Black', 'White', 'Transparent']
+CAPTURES = ['SaveImage', 'Framebuffer', 'Offscreen']
+
+
+def emit(event, **data):
+    sys.stdout.write(json.dumps(dict(event=event, time=time.time(), **data)))
+    sys.stdout.write('\n')
+    sys.stdout.flush()
+
+
+def parseRange(text):
+    try:
+        start, stop = (int(v) for v in text.split(':'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid frame range: {text}')
+    return start, stop
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m freecad.i10g.render',
+        description='Render i10g animations without the workbench UI. '
+                    'Progress is printed as one JSON object per line.')
+    parser.add_argument('files', nargs='+', metavar='FILE',
+                        help='FreeCAD documents with an Animation object')
+    parser.add_argument('-o', '--output',
+                        help='output file, {name} expands to the document '
+                             'name (default: OutputFilename)')
+    parser.add_argument('-r', '--resolution', metavar='WxH',
+                        help='output resolution (default: CustomResolution '
+                             'or Resolution)')
+    parser.add_argument('--fps', type=int, help='frames per second')
+    parser.add_argument('-b', '--background', choices=BACKGROUNDS)
+    parser.add_argument('--ffmpeg', help='FFmpeg executable')
+    parser.add_argument('--capture', choices=CAPTURES, default='Offscreen',
+                        help='capture mode (default: %(default)s)')
+    parser.add_argument('--progress', type=int, default=10, metavar='N',
+                        help='report progress every N frames')
+    parser.add_argument('--workers', type=int,
+                        help='worker processes (default: Workers)')
+    parser.add_argument('--chunk', type=int, metavar='N',
+                        help='frames per worker job, 0 splits by step '
+                             '(default: ChunkFrames)')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='write a Chrome trace of the render')
+    parser.add_argument('--frames', type=parseRange, metavar='START:STOP',
+                        help='only render frames [START, STOP)')
+    return parser.parse_args(argv)
+
+
+def renderFile(path, args):
+    import FreeCAD as App
+    from freecad.i10g import i10g
+
+    start = time.time()
+    doc = App.openDocument(os.path.abspath(path))
+    try:
+        App.setActiveDocument(doc.Name)
+        obj = doc.getObject('Animation')
+        if not obj:
+            emit('error', file=path, message='no Animation object found')
+            return False
+        animation = i10g.Animation(obj)
+        output = args.output
+        if output:
+            output = output.format(name=os.path.splitext(
+                os.path.basename(path))[0])
+        elif not os.path.isabs(obj.OutputFilename):
+            # Relative outputs are kept next to the document
+            output = os.path.join(os.path.dirname(os.path.abspath(path)),
+                                  obj.OutputFilename)
+        emit('load', file=path, steps=len(obj.Group),
+             seconds=time.time() - start)
+
+        def progress(count, total, dt):
+            if count % args.progress == 0 or count == total:
+                left = (total * dt)/count - dt
+                emit('progress', file=path, frame=count, total=total,
+                     seconds=dt, remaining=left)
+
+        stats = animation.render(
+            progress=progress,
+            frames=args.frames,
+            output=output,
+            resolution=args.resolution,
+            fps=args.fps,
+            background=args.background,
+            ffmpeg=args.ffmpeg,
+            capture=args.capture,
+            workers=args.workers,
+            chunk=args.chunk,
+            trace=args.trace,
+        )
+        if not stats:
+            emit('error', file=path, message='FFmpeg path not set')
+            return False
+        stats['total'] = time.time() - start
+        ok = stats['returncode'] == 0
+        emit('done' if ok else 'error', file=path, **stats)
+        return ok
+    finally:
+        App.closeDocument(doc.Name)
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    import FreeCADGui as Gui
+    if not Gui.getMainWindow():
+        # View providers are needed to build the scene graph
+        Gui.setupWithoutGUI()
+    failed = 0
+    for path in args.files:
+        emit('start', file=path)
+        try:
+            if not renderFile(path, args):
+                failed += 1
+        except Exception as e:
+            emit('error', file=path, message=str(e))
+            failed += 1
+    emit('finish', files=len(args.files), failed=failed)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,216 @@
+import numpy
+import pytest
+
+from freecad.i10g import bake, engine
+
+IDENTITY = (0, 0, 0, 1)
+QUARTER = (0, 0, numpy.sin(numpy.pi / 4), numpy.cos(numpy.pi / 4))
+# Pools keep colors as float32, this one is exact in both
+COLOR = (0.5, 0.25, 0.75, 0)
+
+
+def state(objects, table=None):
+    # objects: {name: (x, quat, visible)}
+    names = list(objects)
+    placement = [(x, 0, 0) + tuple(q) for x, q, _ in objects.values()]
+    flags = [engine.VISIBLE * v for _, _, v in objects.values()]
+    rgba = [COLOR] * len(names)
+    return engine.buildState(names, placement, flags, rgba, table)
+
+
+def same(a, b):
+    return a.names == b.names and all(
+        numpy.array_equal(getattr(a, k), getattr(b, k))
+        for k in ('pos', 'quat', 'visible', 'link', 'material', 'rgb',
+                  'transparency'))
+
+
+def test_segment_interpolates_between_steps():
+    a = state({'A': (0, IDENTITY, True), 'B': (1, IDENTITY, True)})
+    b = state({'A': (10, QUARTER, True), 'B': (1, IDENTITY, True)})
+    segment = engine.Segment(a, b)
+    start, middle, end = (segment.frame(d) for d in (0, 0.5, 1))
+    numpy.testing.assert_allclose(start.pos, a.pos)
+    numpy.testing.assert_allclose(start.quat, a.quat, atol=1e-12)
+    numpy.testing.assert_allclose(end.pos, b.pos)
+    numpy.testing.assert_allclose(end.quat, b.quat, atol=1e-12)
+    numpy.testing.assert_allclose(middle.pos[0], (5, 0, 0))
+    eighth = numpy.pi / 8
+    numpy.testing.assert_allclose(
+        middle.quat[0], (0, 0, numpy.sin(eighth), numpy.cos(eighth)))
+    assert list(segment.changed) == [True, False]
+
+
+def test_segment_batches_frames():
+    a = state({'A': (0, IDENTITY, True)})
+    b = state({'A': (4, QUARTER, True)})
+    segment = engine.Segment(a, b)
+    frames = segment.frame(numpy.array([0, 0.25, 1]))
+    assert len(frames) == 3
+    numpy.testing.assert_allclose(frames.pos[:, 0, 0], (0, 1, 4))
+    numpy.testing.assert_allclose(
+        numpy.linalg.norm(frames.quat, axis=-1), 1)
+
+
+def test_segment_takes_the_shorter_rotation():
+    a = state({'A': (0, QUARTER, True)})
+    b = state({'A': (0, tuple(-q for q in QUARTER), True)})
+    segment = engine.Segment(a, b)
+    numpy.testing.assert_allclose(abs(segment.frame(0.5).quat), abs(a.quat))
+
+
+def test_segment_fades_objects_in():
+    a = state({'A': (0, IDENTITY, True)})
+    b = state({'A': (0, IDENTITY, True), 'B': (3, IDENTITY, True)})
+    segment = engine.Segment(a, b)
+    frame = segment.frame(0.5)
+    # B is new, it doesn't move but is driven
+    numpy.testing.assert_allclose(frame.pos[1], (3, 0, 0))
+    assert list(segment.changed) == [False, True]
+
+
+def test_timeline_splits_frames_by_segment():
+    timeline = engine.Timeline([1, 0, 2], 2)
+    assert len(timeline) == 7
+    assert list(timeline.segments) == [0, 0, 2, 2, 2, 2, 2]
+    numpy.testing.assert_allclose(timeline.deltas,
+                                  (0, 0.5, 0, 0.25, 0.5, 0.75, 1))
+    # Zero length segments get no frames
+    assert len(timeline.segment(1)) == 0
+    numpy.testing.assert_allclose(timeline.segment(0), (0, 0.5))
+
+
+def test_timeline_locates_times():
+    timeline = engine.Timeline([1, 2], 24)
+    segment, delta = timeline.locate(2)
+    assert (int(segment), float(delta)) == (1, 0.5)
+    segment, delta = timeline.locate(10)
+    assert (int(segment), float(delta)) == (1, 1)
+    assert len(engine.Timeline([], 24)) == 0
+
+
+def test_pool_interns_equal_states_once():
+    pool = engine.StatePool()
+    a = state({'A': (0, IDENTITY, True), 'B': (0, IDENTITY, True)})
+    ids = pool.intern(a)
+    assert ids[0] == ids[1] and len(pool) == 1
+    b = state({'C': (0, IDENTITY, True)})
+    assert list(pool.intern(b)) == [ids[0]]
+    assert len(pool) == 1
+    assert b.table is pool.table
+
+
+def test_pool_snapshots_store_diffs():
+    pool = engine.StatePool()
+    a = state({'A': (0, IDENTITY, True), 'B': (1, IDENTITY, True)})
+    b = state({'A': (5, IDENTITY, True), 'B': (1, IDENTITY, True)})
+    c = state({'A': (5, IDENTITY, True)})
+    s0 = pool.snapshot(a)
+    s1 = pool.snapshot(b, s0)
+    assert pool.snapshot(b, s1) == s1
+    s2 = pool.snapshot(c, s1)
+    assert pool.snapshots[s1][0] == s0
+    assert len(pool.snapshots[s1][2]) == 1
+    assert pool.table.get(pool.snapshots[s2][4]) == ['B']
+    for snapshot, arrays in ((s0, a), (s1, b), (s2, c)):
+        assert same(pool.get(snapshot), arrays)
+
+
+def test_pool_inserts_keyframes():
+    pool = engine.StatePool()
+    snapshot = -1
+    for i in range(engine.KEYFRAME_INTERVAL + 1):
+        snapshot = pool.snapshot(state({'A': (i, IDENTITY, True)}), snapshot)
+    assert max(depth for _, depth, _, _, _ in pool.snapshots.values()) \
+        < engine.KEYFRAME_INTERVAL
+    assert pool.snapshots[snapshot][0] == -1
+    numpy.testing.assert_allclose(pool.get(snapshot).pos[0],
+                                  (engine.KEYFRAME_INTERVAL, 0, 0))
+
+
+def test_pool_encode_prunes_and_round_trips():
+    pool = engine.StatePool()
+    a = state({'A': (0, IDENTITY, True), 'B': (1, IDENTITY, True)})
+    b = state({'A': (2, IDENTITY, False), 'B': (1, IDENTITY, True)})
+    s0 = pool.snapshot(a)
+    s1 = pool.snapshot(b, s0)
+    unused = pool.snapshot(state({'A': (9, IDENTITY, True)}), s1)
+    digests = [engine.stateDigest(engine.encodePooled(s), pool)
+               for s in (s0, s1)]
+    encoded = pool.encode([s1])
+    decoded = engine.StatePool.decode(encoded)
+    assert unused not in decoded.snapshots
+    assert len(decoded) == len(pool) - 1
+    assert decoded.next == pool.next
+    for snapshot, arrays, digest in zip((s0, s1), (a, b), digests):
+        assert same(decoded.get(snapshot), arrays)
+        assert engine.stateDigest(engine.encodePooled(snapshot),
+                                  decoded) == digest
+    # New snapshots don't reuse ids that undo may bring back
+    assert decoded.snapshot(state({'A': (7, IDENTITY, True)})) >= pool.next
+
+
+def test_pool_rejects_unknown_versions():
+    with pytest.raises(ValueError):
+        engine.StatePool.decode({'version': engine.POOLED + 1})
+    with pytest.raises(ValueError):
+        engine.decodeState(engine.encodePooled(0))
+
+
+def plan(steps, timeline, signatures=None):
+    signatures = signatures or [str(i) for i in range(len(steps) - 1)]
+    return [(signatures[i], timeline.segment(i),
+             lambda i=i: engine.Segment(steps[i], steps[i + 1]))
+            for i in range(len(steps) - 1)]
+
+
+def test_bake_update_rewrites_changed_segments():
+    names = ['A', 'B']
+    steps = [state({'A': (x, IDENTITY, True), 'B': (y, IDENTITY, True)})
+             for x, y in ((0, 0), (1, 0), (1, 2))]
+    timeline = engine.Timeline([1, 1], 4)
+    baked = bake.Bake()
+    assert baked.update(names, plan(steps, timeline))
+    assert len(baked) == len(timeline)
+    assert not baked.update(names, plan(steps, timeline))
+    # Every object is driven on the very first frame, later ones on the
+    # first frame of a segment if they moved in the one before
+    assert list(baked.frame(0).driven) == [True, True]
+    first = baked.segments[1][0]
+    assert list(baked.frame(first).driven) == [True, True]
+    assert list(baked.frame(first + 1).driven) == [False, True]
+    numpy.testing.assert_allclose(baked.frame(len(baked) - 1).pos[:, 0],
+                                  (1, 2))
+
+    steps[2] = state({'A': (1, IDENTITY, True), 'B': (3, IDENTITY, True)})
+    # Same signature, stale segments are written again
+    assert not baked.update(names, plan(steps, timeline))
+    baked.invalidate([1])
+    assert baked.update(names, plan(steps, timeline))
+    numpy.testing.assert_allclose(baked.frame(len(baked) - 1).pos[:, 0],
+                                  (1, 3))
+
+    steps[2] = state({'A': (1, IDENTITY, True), 'B': (4, IDENTITY, True)})
+    assert baked.update(names, plan(steps, timeline, ['0', 'changed']))
+    numpy.testing.assert_allclose(baked.frame(len(baked) - 1).pos[:, 0],
+                                  (1, 4))
+
+
+def test_bake_frame_drives_skipped_objects():
+    names = ['A', 'B']
+    steps = [state({'A': (0, IDENTITY, True), 'B': (0, IDENTITY, True)}),
+             state({'A': (1, IDENTITY, True), 'B': (0, IDENTITY, True)})]
+    baked = bake.Bake()
+    baked.update(names, plan(steps, engine.Timeline([1], 4)))
+    assert list(baked.frame(3).driven) == [True, False]
+    assert list(baked.frame(3, full=True).driven) == [True, True]
+
+
+def test_sort_keys_fit_between_any_two():
+    keys = [engine.keyBetween()]
+    for _ in range(100):
+        keys.append(engine.keyBetween(keys[-1]))
+    for _ in range(100):
+        keys.insert(1, engine.keyBetween(keys[0], keys[1]))
+    keys.insert(0, engine.keyBetween('', keys[0]))
+    assert keys == sorted(keys) and len(set(keys)) == len(keys)